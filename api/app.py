@@ -4,13 +4,15 @@ FastAPI + Motor (async MongoDB) integration for IDS.
 Saves flows and alerts, schedules blocking, uses joblib RandomForest model for detection.
 
 Features in this improved version:
-- JSON-safe conversion helper for ObjectId and datetimes
+- orjson responses with ObjectId/datetime handling
 - FEATURE_ORDER fallback
 - USE_REAL_BLOCKING env toggle to enable actual iptables manipulation (guarded)
 - Better logging
 """
 import os
 import asyncio
+import csv
+import io
 from dotenv import load_dotenv
 
 # Load .env file into environment variables (override=True ensures we pick up SSL_CERT_FILE)
@@ -25,11 +27,12 @@ if _ssl_cert and os.path.isfile(_ssl_cert):
     ssl._create_default_https_context = ssl._create_unverified_context  # fallback
 
 import joblib
-import pandas as pd
 import numpy as np
+import orjson
 from datetime import datetime, timedelta
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -37,11 +40,19 @@ import subprocess
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from bson import ObjectId
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import socket
 import shutil
+import threading
+import ipaddress
+import heapq
+import zlib
+from functools import lru_cache
 
 LOG = logging.getLogger("uvicorn.error")
-app = FastAPI(title="IDS Model Detector w/ MongoDB")
+# ORJSONResponse for every plain dict reply (/detect included); Mongo docs go through json_response below
+app = FastAPI(title="IDS Model Detector w/ MongoDB", default_response_class=ORJSONResponse)
 
 # Add CORS middleware to allow dashboard access
 app.add_middleware(
@@ -55,18 +66,39 @@ app.add_middleware(
 # -------- Configuration ----------
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 MODEL_PATH = os.path.join(PROJECT_ROOT, "models", "saved_models", "rf_model.joblib")
+MODEL_BASENAME = os.path.basename(MODEL_PATH)  # model_version stamped on alerts / production_data
+ONNX_MODEL_PATH = os.path.splitext(MODEL_PATH)[0] + ".onnx"  # compiled copy written by models/export_onnx.py
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("IDS_DB", "idsdb")
 DEFAULT_BLOCK_DURATION_SEC = int(os.getenv("BLOCK_DURATION_SEC", "600"))  # 10 minutes default
 DEFAULT_THRESHOLD = float(os.getenv("MODEL_THRESHOLD", "0.7"))
 ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+WHITELIST_REFRESH_SEC = float(os.getenv("WHITELIST_REFRESH_SEC", "30"))
+UNBLOCK_REAPER_INTERVAL_SEC = float(os.getenv("UNBLOCK_REAPER_INTERVAL_SEC", "10"))
+# TTL only removes blocked_ips docs the reaper never got to (e.g. API was down); keep it well past unblock_at
+BLOCK_TTL_GRACE_SEC = int(os.getenv("BLOCK_TTL_GRACE_SEC", "3600"))
+# /detect writes are buffered and flushed with insert_many every WRITE_FLUSH_INTERVAL_MS or WRITE_FLUSH_MAX_DOCS docs
+WRITE_FLUSH_INTERVAL_SEC = float(os.getenv("WRITE_FLUSH_INTERVAL_MS", "50")) / 1000.0
+WRITE_FLUSH_MAX_DOCS = int(os.getenv("WRITE_FLUSH_MAX_DOCS", "500"))
+# A failed flush puts its docs back and the next flush waits twice as long (up to WRITE_FLUSH_MAX_BACKOFF_SEC);
+# a doc that fails WRITE_FLUSH_MAX_ATTEMPTS flushes is dropped with an error
+WRITE_FLUSH_MAX_ATTEMPTS = int(os.getenv("WRITE_FLUSH_MAX_ATTEMPTS", "5"))
+WRITE_FLUSH_MAX_BACKOFF_SEC = float(os.getenv("WRITE_FLUSH_MAX_BACKOFF_SEC", "5"))
 
 # Allow turning on real blocking on capable Linux hosts
 USE_REAL_BLOCKING = os.getenv("USE_REAL_BLOCKING", "").lower() in ("1", "true", "yes")
 
+# Inference backend: "sklearn" (default), or opt in to "fil" (RAPIDS FIL, GPU) / "onnx" (ONNX Runtime, CPU;
+# export the model first with models/export_onnx.py). Falls back to sklearn if the backend can't load.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "sklearn").lower()
+# Micro-batching for /detect: collect up to MAX_INFERENCE_BATCH rows, waiting at most INFERENCE_BATCH_WAIT_MS
+MAX_INFERENCE_BATCH = int(os.getenv("MAX_INFERENCE_BATCH", "64"))
+INFERENCE_BATCH_WAIT_SEC = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "2")) / 1000.0
+FIL_BATCH_SIZE = int(os.getenv("FIL_BATCH_SIZE", str(MAX_INFERENCE_BATCH)))
+
 # Default feature order (fallback if no model metadata present)
 DEFAULT_FEATURE_ORDER = ["total_packets","total_bytes","duration","pkts_per_sec","bytes_per_sec","syn_count","unique_dst_ports"]
-FEATURE_ORDER = DEFAULT_FEATURE_ORDER.copy()
+FEATURE_ORDER = tuple(DEFAULT_FEATURE_ORDER)
 CONFIG_DOC_ID = "detection_policy"
 CONFIG_CACHE = {
     "_id": CONFIG_DOC_ID,
@@ -75,6 +107,8 @@ CONFIG_CACHE = {
     "blocking_enabled": True,  # Master toggle for IP blocking
     "updated_at": None,
 }
+# Whitelisted IPs, mirrored from db.whitelist (refreshed periodically and on every whitelist edit)
+WHITELIST: set = set()
 # -------------------------------
 
 # Load model (sync) - fail early if missing
@@ -83,13 +117,39 @@ if not os.path.exists(MODEL_PATH):
 
 model = joblib.load(MODEL_PATH)
 
-# Thread pool for blocking calls and CPU-bound sync model calls
-executor = ThreadPoolExecutor(max_workers=2)
+# A model fitted on a DataFrame makes sklearn re-check (and warn about) feature names on every
+# ndarray predict. /detect always sends columns in FEATURE_ORDER, so check the names once and drop them.
+_fitted_feature_names = getattr(model, "feature_names_in_", None)
+if _fitted_feature_names is not None:
+    if tuple(_fitted_feature_names) != FEATURE_ORDER:
+        LOG.warning("Model feature names %s differ from FEATURE_ORDER %s",
+                    list(_fitted_feature_names), FEATURE_ORDER)
+    del model.feature_names_in_
+# Model used by /detect; replaced by the FIL or ONNX forest on startup when INFERENCE_BACKEND asks for one
+inference_model = model
+
+# Separate pools so a slow iptables call never queues model inference behind it
+CPU_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ids-cpu")  # model inference; the batcher runs one batch at a time
+IO_EXEC = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ids-io")  # iptables and other blocking I/O
 
 # Motor client will be created on startup
 mongo_client: Optional[AsyncIOMotorClient] = None
 db = None
 
+# Pending (feature_row, future) pairs for the inference batcher; created on startup
+inference_queue: Optional[asyncio.Queue] = None
+background_jobs = []
+
+# Pending inserts per collection (flows before alerts, which embed them); drained by flush_loop
+WRITE_BUFFERS: Dict[str, list] = {"flows": [], "production_data": [], "alerts": []}
+write_buffer_full: Optional[asyncio.Event] = None
+# _id -> failed flushes so far, for docs waiting to be retried
+WRITE_ATTEMPTS: Dict[ObjectId, int] = {}
+
+# (loop.time() deadline, ip) min-heap of blocks made by this process; wakes unblock_reaper on time
+UNBLOCK_QUEUE: list = []
+unblock_scheduled: Optional[asyncio.Event] = None
+
 # -------- Pydantic model ----------
 class FeatureVec(BaseModel):
     src_ip: str
@@ -120,26 +180,19 @@ class ManualBlockRequest(BaseModel):
     note: Optional[str] = None
 # ----------------------------------
 
-# JSON-safe conversion helper
-def make_jsonable(doc: Any):
-    """Convert BSON types (ObjectId, datetimes) to JSON-serializable types."""
-    if isinstance(doc, dict):
-        out = {}
-        for k, v in doc.items():
-            out[k] = make_jsonable(v)
-        return out
-    if isinstance(doc, list):
-        return [make_jsonable(x) for x in doc]
-    if isinstance(doc, ObjectId):
-        return str(doc)
-    # datetimes -> ISO format
-    try:
-        # datetime objects have isoformat
-        if hasattr(doc, "isoformat"):
-            return doc.isoformat()
-    except Exception:
-        pass
-    return doc
+# JSON responses: orjson serializes datetimes natively (naive -> ISO 8601, as isoformat());
+# only BSON types need the fallback
+def _json_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    raise TypeError
+
+
+def json_response(content) -> Response:
+    """Serialize Mongo docs straight to a JSON response, skipping FastAPI's jsonable_encoder pass."""
+    return Response(orjson.dumps(content, default=_json_default), media_type="application/json")
 
 
 async def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
@@ -157,10 +210,40 @@ async def create_indexes():
     # alerts
     await db.alerts.create_index([("detected_at", -1)])
     await db.alerts.create_index([("src_ip", 1)])
+    await db.alerts.create_index([("features._id", 1)])  # flow -> alert join in export_flows
+    # production_data: unlabeled queue / recent samples, predicted-attack filter, label stats, export, per-source lookups
+    await db.production_data.create_indexes([
+        IndexModel([("labeled", 1), ("collected_at", -1)]),
+        IndexModel([("collected_at", -1)]),
+        IndexModel([("prediction.is_attack", 1), ("labeled", 1), ("collected_at", -1)]),
+        IndexModel([("true_label", 1)]),
+        IndexModel([("labeled", 1), ("confidence", 1)]),
+        IndexModel([("src_ip", 1)]),
+    ])
     # whitelist unique
     await db.whitelist.create_index("ip", unique=True)
-    # blocked_ips: index ip and TTL on expireAt
-    await db.blocked_ips.create_index("ip")
+    # blocked_ips: unique ip (one active block per IP) and TTL on expireAt
+    try:
+        await db.blocked_ips.create_index("ip", unique=True)
+    except OperationFailure:
+        # older deployments have a non-unique ip_1. MongoDB won't keep a second index on the same
+        # key, so it has to be dropped first: only do that when no IP is blocked twice, and put the
+        # plain index back if the unique build still fails (e.g. a duplicate inserted meanwhile).
+        duplicates = await db.blocked_ips.aggregate([
+            {"$group": {"_id": "$ip", "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+            {"$limit": 1},
+        ]).to_list(length=1)
+        if duplicates:
+            LOG.warning("Could not make blocked_ips.ip unique; remove duplicate blocks and restart")
+        else:
+            await db.blocked_ips.drop_index("ip_1")
+            try:
+                await db.blocked_ips.create_index("ip", unique=True)
+            except OperationFailure:
+                await db.blocked_ips.create_index("ip")
+                LOG.warning("Could not make blocked_ips.ip unique; remove duplicate blocks and restart")
+    await db.blocked_ips.create_index("unblock_at")  # unblock reaper
     try:
         await db.blocked_ips.create_index("expireAt", expireAfterSeconds=0)
     except Exception:
@@ -201,20 +284,176 @@ async def load_policy_config():
     )
     return CONFIG_CACHE
 
+async def refresh_whitelist():
+    """Reload the in-memory whitelist from MongoDB."""
+    global WHITELIST
+    WHITELIST = {d["ip"] async for d in db.whitelist.find({}, {"ip": 1, "_id": 0})}
+    return WHITELIST
+
+
+async def whitelist_refresh_loop():
+    """Pick up whitelist edits made outside this process (e.g. api/add_whitelist.py)."""
+    while True:
+        await asyncio.sleep(WHITELIST_REFRESH_SEC)
+        try:
+            await refresh_whitelist()
+        except Exception:
+            LOG.exception("Whitelist refresh failed; keeping %d cached entries", len(WHITELIST))
+
+def buffer_insert(collection: str, doc: dict) -> ObjectId:
+    """Queue doc for the next batched insert. The _id is assigned client-side so callers can use it now."""
+    doc.setdefault("_id", ObjectId())
+    buf = WRITE_BUFFERS[collection]
+    buf.append(doc)
+    if len(buf) >= WRITE_FLUSH_MAX_DOCS:
+        write_buffer_full.set()
+    return doc["_id"]
+
+
+async def flush_write_buffers() -> bool:
+    """Write out everything buffered so far, one insert_many per collection.
+
+    Docs that fail go back to the front of their buffer for the next flush. Their _ids are fixed, so
+    a doc that did land before an error comes back as a duplicate key and is not retried.
+    Returns False if anything has to be retried.
+    """
+    ok = True
+    for name in WRITE_BUFFERS:
+        batch = WRITE_BUFFERS[name]
+        if not batch:
+            continue
+        WRITE_BUFFERS[name] = []
+        try:
+            await db[name].insert_many(batch, ordered=False)
+            failed = []
+        except BulkWriteError as exc:
+            failed_at = {e["index"] for e in exc.details.get("writeErrors", []) if e.get("code") != 11000}
+            failed = [batch[i] for i in sorted(failed_at)]
+            if failed:
+                LOG.warning("Failed to write %d of %d buffered %s docs", len(failed), len(batch), name)
+        except Exception:
+            LOG.exception("Failed to write %d buffered %s docs", len(batch), name)
+            failed = batch
+        retry = []
+        for doc in failed:
+            attempts = WRITE_ATTEMPTS.get(doc["_id"], 0) + 1
+            if attempts < WRITE_FLUSH_MAX_ATTEMPTS:
+                WRITE_ATTEMPTS[doc["_id"]] = attempts
+                retry.append(doc)
+        if WRITE_ATTEMPTS:
+            # forget the counts of docs that were written (or given up on)
+            retrying = {doc["_id"] for doc in retry}
+            for doc in batch:
+                if doc["_id"] not in retrying:
+                    WRITE_ATTEMPTS.pop(doc["_id"], None)
+        if not failed:
+            continue
+        ok = False
+        if len(retry) < len(failed):
+            LOG.error("Dropping %d %s docs after %d failed writes",
+                      len(failed) - len(retry), name, WRITE_FLUSH_MAX_ATTEMPTS)
+        WRITE_BUFFERS[name] = retry + WRITE_BUFFERS[name]
+    return ok
+
+
+async def flush_loop():
+    backoff = 0.0
+    while True:
+        if backoff:
+            # Mongo is failing: wait out the backoff even if the buffers fill up
+            await asyncio.sleep(backoff)
+        else:
+            try:
+                await asyncio.wait_for(write_buffer_full.wait(), WRITE_FLUSH_INTERVAL_SEC)
+            except asyncio.TimeoutError:
+                pass
+        write_buffer_full.clear()
+        if await flush_write_buffers():
+            backoff = 0.0
+        else:
+            backoff = min(max(backoff * 2, WRITE_FLUSH_INTERVAL_SEC * 2), WRITE_FLUSH_MAX_BACKOFF_SEC)
+
 # ---------- Blocking helpers (run in thread) ----------
+# Resolved once: the binary's location is fixed for the life of the process
+_IPTABLES_RESTORE_PATH = shutil.which("iptables-restore")
+
+# One long-lived `iptables-restore --noflush` fed a rule change per block/unblock, instead of
+# forking `iptables` (and reloading the rule table) every time. Shared by executor threads.
+_restore_proc: Optional[subprocess.Popen] = None
+_restore_lock = threading.Lock()
+
 def _iptables_available():
-    return shutil.which("iptables") is not None
+    return _IPTABLES_RESTORE_PATH is not None
+
+def _iptables_apply(op: str, ip: str):
+    """Run a single '-I'/'-D INPUT -s ip -j DROP' transaction on the iptables-restore pipe.
+
+    Each COMMIT is followed by an '# ack' comment; with --verbose, iptables-restore echoes comments
+    as it reaches them, so reading the ack back confirms the COMMIT before this returns.
+    A failed rule (e.g. deleting one that is gone) makes the process exit instead: that raises
+    CalledProcessError with its stderr, and the next call starts a fresh process.
+    """
+    global _restore_proc
+    # ip is written into the restore script, so it must be a bare address (no extra rule text)
+    ip = str(ipaddress.ip_address(ip))
+    ack = f"# ack {op} {ip}\n"
+    rules = f"*filter\n{op} INPUT -s {ip} -j DROP\nCOMMIT\n{ack}"
+    with _restore_lock:
+        for attempt in range(2):
+            if _restore_proc is None or _restore_proc.poll() is not None:
+                _restore_proc = subprocess.Popen(
+                    ["sudo", _IPTABLES_RESTORE_PATH, "--noflush", "--wait", "--verbose"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                )
+            proc = _restore_proc
+            try:
+                proc.stdin.write(rules)
+                proc.stdin.flush()
+            except (BrokenPipeError, OSError):
+                # died before reading this transaction (e.g. sudo refused); retry once on a new process
+                _restore_proc = None
+                if attempt:
+                    raise
+                continue
+            for line in proc.stdout:
+                if line == ack:
+                    return
+            # EOF before the ack: the transaction failed and iptables-restore exited
+            _restore_proc = None
+            proc.stdin.close()
+            err = proc.stderr.read()
+            raise subprocess.CalledProcessError(proc.wait(), proc.args, stderr=err)
+
+def close_iptables_pipe():
+    global _restore_proc
+    with _restore_lock:
+        if _restore_proc is not None and _restore_proc.poll() is None:
+            _restore_proc.stdin.close()
+            try:
+                _restore_proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                _restore_proc.kill()
+        _restore_proc = None
+
+@lru_cache(maxsize=4096)
+def _is_private_ip(ip: str) -> bool:
+    """True for RFC1918, loopback, link-local and other non-routable v4/v6 ranges; ValueError if not an IP."""
+    return ipaddress.ip_address(ip).is_private
 
 def block_ip_iptables(ip: str) -> bool:
     """Apply iptables rule to drop incoming traffic from ip.
     Will only run if USE_REAL_BLOCKING is True and iptables exists.
     """
     # Safety: avoid blocking private/local addresses
-    private_prefixes = ("127.", "10.", "192.168.", "172.16.", "172.17.", "172.18.", "172.19.", "172.20.",
-                        "172.21.", "172.22.", "172.23.", "172.24.", "172.25.", "172.26.", "172.27.",
-                        "172.28.", "172.29.", "172.30.", "172.31.")
-    if ip.startswith(private_prefixes):
-        LOG.info("Refuse to block private IP: %s", ip)
+    try:
+        if _is_private_ip(ip):
+            LOG.info("Refuse to block private IP: %s", ip)
+            return False
+    except ValueError:
+        LOG.warning("Refuse to block invalid IP address: %r", ip)
         return False
 
     if not USE_REAL_BLOCKING:
@@ -227,12 +466,17 @@ def block_ip_iptables(ip: str) -> bool:
 
     try:
         # Use sudo if not running as root — environment must allow passwordless sudo or run service as root
-        cmd = ["sudo", "iptables", "-I", "INPUT", "-s", ip, "-j", "DROP"]
-        subprocess.check_call(cmd)
+        _iptables_apply("-I", ip)
         LOG.info("iptables DROP inserted for %s", ip)
         return True
-    except subprocess.CalledProcessError:
-        LOG.exception("iptables call failed for %s", ip)
+    except ValueError:
+        LOG.warning("Refuse to block invalid IP address: %r", ip)
+        return False
+    except subprocess.CalledProcessError as exc:
+        LOG.error("iptables-restore rejected block for %s: %s", ip, (exc.stderr or "").strip())
+        return False
+    except OSError:
+        LOG.exception("iptables-restore call failed for %s", ip)
         return False
     except Exception:
         LOG.exception("Unexpected error while attempting iptables block for %s", ip)
@@ -248,11 +492,16 @@ def unblock_ip_iptables(ip: str) -> bool:
         return False
 
     try:
-        cmd = ["sudo", "iptables", "-D", "INPUT", "-s", ip, "-j", "DROP"]
-        subprocess.check_call(cmd)
+        _iptables_apply("-D", ip)
         LOG.info("iptables DROP removed for %s", ip)
         return True
-    except subprocess.CalledProcessError:
+    except ValueError:
+        LOG.warning("Cannot unblock invalid IP address: %r", ip)
+        return False
+    except subprocess.CalledProcessError as exc:
+        LOG.error("iptables-restore rejected unblock for %s: %s", ip, (exc.stderr or "").strip())
+        return False
+    except OSError:
         LOG.exception("Failed to remove iptables rule for %s", ip)
         return False
     except Exception:
@@ -281,32 +530,33 @@ def classify_attack_type(fv) -> str:
     return "Suspicious Activity"
 
 async def schedule_block_and_unblock(ip: str, duration_sec: int, *, reason: str = "auto-detect", actor: str = "model", note: Optional[str] = None):
-    """Insert blocked_ips doc with expireAt so Mongo TTL removes it, and perform local iptables block/unblock."""
-    # Check if IP is already blocked (prevent duplicate entries)
-    existing = await db.blocked_ips.find_one({"ip": ip})
-    if existing:
-        LOG.info("IP %s is already blocked (doc %s), skipping duplicate block", ip, existing.get("_id"))
-        return
-    
-    unblock_at = datetime.utcnow() + timedelta(seconds=duration_sec)
+    """Insert blocked_ips doc and apply the local iptables block; unblock_reaper lifts it at unblock_at."""
+    now = datetime.utcnow()
+    unblock_at = now + timedelta(seconds=duration_sec)
     doc = {
         "ip": ip,
-        "blocked_at": datetime.utcnow(),
+        "blocked_at": now,
         "unblock_at": unblock_at,
         "duration_sec": duration_sec,
         "reason": reason,
         "actor": actor,
-        "expireAt": unblock_at  # TTL index will remove this doc when time arrives
+        "expireAt": unblock_at + timedelta(seconds=BLOCK_TTL_GRACE_SEC),  # TTL backstop, see unblock_reaper
+        "applied": False,  # set once the iptables rule is in; only applied rules are deleted later
     }
     if note:
         doc["note"] = note
-    res = await db.blocked_ips.insert_one(doc)
+    try:
+        res = await db.blocked_ips.insert_one(doc)
+    except DuplicateKeyError:
+        # unique ip index: a concurrent detection already blocked this IP
+        LOG.info("IP %s is already blocked, skipping duplicate block", ip)
+        return
     LOG.info("Inserted blocked_ips doc %s for %s", res.inserted_id, ip)
 
     # ALSO store in permanent history collection (never expires)
     history_doc = {
         "ip": ip,
-        "blocked_at": datetime.utcnow(),
+        "blocked_at": now,
         "unblock_at": unblock_at,
         "duration_sec": duration_sec,
         "reason": reason,
@@ -319,28 +569,185 @@ async def schedule_block_and_unblock(ip: str, duration_sec: int, *, reason: str
 
     # Apply iptables rule in thread (best-effort)
     loop = asyncio.get_running_loop()
-    ok = await loop.run_in_executor(executor, block_ip_iptables, ip)
-    if not ok:
+    ok = await loop.run_in_executor(IO_EXEC, block_ip_iptables, ip)
+    if ok:
+        await db.blocked_ips.update_one({"_id": res.inserted_id}, {"$set": {"applied": True}})
+    else:
         LOG.warning("Local iptables block failed or skipped for %s; entry still exists in DB", ip)
 
-    # schedule local unblock after duration (best effort)
-    async def delayed_unblock():
-        await asyncio.sleep(duration_sec + 1)
-        await loop.run_in_executor(executor, unblock_ip_iptables, ip)
+    heapq.heappush(UNBLOCK_QUEUE, (loop.time() + duration_sec, ip))
+    unblock_scheduled.set()
+
 
-    asyncio.create_task(delayed_unblock())
+def _rule_applied(doc) -> bool:
+    # docs written before the flag existed may have a live rule, so they count as applied
+    return doc.get("applied", True)
 
 
 async def remove_block(ip: str):
     """Remove block entry and attempt iptables cleanup."""
+    docs = await db.blocked_ips.find({"ip": ip}, {"applied": 1}).to_list(None)
     await db.blocked_ips.delete_many({"ip": ip})
+    if any(_rule_applied(d) for d in docs):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(IO_EXEC, unblock_ip_iptables, ip)
+
+
+async def reap_expired_blocks():
+    """Lift every block whose unblock_at has passed, then drop its doc."""
     loop = asyncio.get_running_loop()
-    await loop.run_in_executor(executor, unblock_ip_iptables, ip)
+    now = datetime.utcnow()
+    async for d in db.blocked_ips.find({"unblock_at": {"$lte": now}}, {"ip": 1, "applied": 1}):
+        # a '-D' for a rule that was never inserted would only fail
+        if _rule_applied(d):
+            await loop.run_in_executor(IO_EXEC, unblock_ip_iptables, d["ip"])
+        await db.blocked_ips.delete_one({"_id": d["_id"]})
+        LOG.info("Block on %s expired; removed", d["ip"])
+
+
+async def unblock_reaper():
+    """Single timer instead of a sleeping task per block, so expiries survive restarts.
+
+    Sleeps until the earliest deadline in UNBLOCK_QUEUE, or at most UNBLOCK_REAPER_INTERVAL_SEC to pick up
+    blocks this process doesn't know about (made before a restart or by another worker).
+    blocked_ips stays the source of truth; the heap only decides when to look.
+    """
+    loop = asyncio.get_running_loop()
+    next_poll = loop.time()
+    while True:
+        now = loop.time()
+        due = now >= next_poll
+        while UNBLOCK_QUEUE and UNBLOCK_QUEUE[0][0] <= now:
+            heapq.heappop(UNBLOCK_QUEUE)
+            due = True
+        if due:
+            try:
+                await reap_expired_blocks()
+            except Exception:
+                LOG.exception("Unblock reaper pass failed")
+            next_poll = loop.time() + UNBLOCK_REAPER_INTERVAL_SEC
+        wake_at = min(next_poll, UNBLOCK_QUEUE[0][0]) if UNBLOCK_QUEUE else next_poll
+        # a new block only wakes us to recompute wake_at
+        unblock_scheduled.clear()
+        try:
+            await asyncio.wait_for(unblock_scheduled.wait(), max(0.0, wake_at - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+
+# ---------- Inference backend ----------
+def _load_fil_model(skl_model):
+    """Import the sklearn forest into RAPIDS FIL (nvforest, or cuML's FIL on older installs)."""
+    try:
+        import nvforest
+        fil_model = nvforest.load_from_sklearn(skl_model, device="auto")
+    except ImportError:
+        from cuml.fil import ForestInference
+        fil_model = ForestInference.load_from_sklearn(skl_model, output_class=True)
+    # auto-tune layout / chunk size for the batch size /detect actually uses
+    fil_model.optimize(batch_size=FIL_BATCH_SIZE)
+    return fil_model
+
+
+class OnnxForest:
+    """sklearn-compatible predict/predict_proba over an ONNX Runtime session (releases the GIL in run)."""
+
+    def __init__(self, onnx_path: str):
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, x):
+        return self.session.run(None, {self.input_name: x})[0]
+
+    def predict_proba(self, x):
+        return self.session.run(None, {self.input_name: x})[1]
+
+
+def _load_onnx_model(skl_model):
+    """Open a CPU session over the exported ONNX copy of the forest (models/export_onnx.py)."""
+    if not os.path.exists(ONNX_MODEL_PATH):
+        raise FileNotFoundError(f"{ONNX_MODEL_PATH} not found; run models/export_onnx.py")
+    if os.path.getmtime(ONNX_MODEL_PATH) < os.path.getmtime(MODEL_PATH):
+        raise RuntimeError(f"{ONNX_MODEL_PATH} is older than {MODEL_PATH}; re-run models/export_onnx.py")
+    return OnnxForest(ONNX_MODEL_PATH)
+
+
+def load_inference_backend():
+    """Pick the forest implementation used by /detect; sklearn is always the fallback."""
+    global inference_model
+    inference_model = model
+    loaders = [("fil", "RAPIDS FIL", _load_fil_model), ("onnx", "ONNX Runtime", _load_onnx_model)]
+    for name, label, loader in loaders:
+        if INFERENCE_BACKEND != name:
+            continue
+        try:
+            inference_model = loader(model)
+            LOG.info("Using %s for model inference", label)
+            return inference_model
+        except ImportError:
+            LOG.warning("%s not installed; skipping it for model inference", label)
+        except Exception:
+            LOG.exception("Could not load model into %s", label)
+    LOG.info("Using sklearn for model inference")
+    return inference_model
+
+# ---------- Inference micro-batcher ----------
+def predict_batch(batch):
+    """Run the forest once over a (B, n_features) batch; returns (labels, positive-class probs)."""
+    proba = np.asarray(inference_model.predict_proba(batch))
+    # if model has two columns, second is positive class
+    if proba.shape[1] > 1:
+        probs = proba[:, 1]
+        # same label model.predict would give, without walking the forest a second time
+        preds = model.classes_[(probs > 0.5).astype(np.intp)]
+    else:
+        probs = proba[:, 0]
+        preds = np.repeat(model.classes_[0], len(probs))
+    return preds, probs
+
+
+async def batcher_loop():
+    """Drain queued /detect rows into batches so each predict call amortizes its fixed overhead."""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await inference_queue.get()]
+        deadline = loop.time() + INFERENCE_BATCH_WAIT_SEC
+        while len(items) < MAX_INFERENCE_BATCH:
+            if not inference_queue.empty():
+                items.append(inference_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(inference_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        batch = np.asarray([row for row, _ in items], dtype=np.float32)
+        try:
+            preds, probs = await loop.run_in_executor(CPU_EXEC, predict_batch, batch)
+        except Exception as exc:
+            LOG.exception("Batched model inference failed for %d rows", len(items))
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(exc)
+            continue
+        for (_, fut), pred, prob in zip(items, preds, probs):
+            if not fut.done():
+                fut.set_result((int(pred), float(prob)))
+
+
+async def submit_for_inference(row) -> tuple:
+    """Queue one feature row for the batcher and wait for its (pred, prob)."""
+    fut = asyncio.get_running_loop().create_future()
+    await inference_queue.put((row, fut))
+    return await fut
 
 # ---------- FastAPI startup/shutdown ----------
 @app.on_event("startup")
 async def startup():
-    global mongo_client, db
+    global mongo_client, db, inference_queue, write_buffer_full, unblock_scheduled
     LOG.info("Starting application. MONGO_URI=%s DB=%s", MONGO_URI, DB_NAME)
     # Create Mongo client with TLS CA bundle if SSL_CERT_FILE provided in environment
     mongo_kwargs = {}
@@ -351,16 +758,27 @@ async def startup():
 
     # If USE_REAL_BLOCKING requested but iptables missing, log a warning
     if USE_REAL_BLOCKING and not _iptables_available():
-        LOG.warning("USE_REAL_BLOCKING is set but iptables binary not found on host. Blocking will be mocked in DB only.")
+        LOG.warning("USE_REAL_BLOCKING is set but iptables-restore binary not found on host. Blocking will be mocked in DB only.")
 
     if not ADMIN_API_KEY:
         LOG.warning("ADMIN_API_KEY not set; admin endpoints are exposed without authentication.")
 
+    load_inference_backend()
+    # one dummy batch pages in the trees and fills backend dispatch caches, so the first /detect
+    # sees steady-state latency
+    try:
+        predict_batch(np.zeros((1, len(FEATURE_ORDER)), dtype=np.float32))
+    except Exception:
+        LOG.exception("Model warm-up prediction failed")
+    inference_queue = asyncio.Queue()
+    background_jobs.append(asyncio.create_task(batcher_loop()))
+
     mongo_client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=10000, **mongo_kwargs)
     db = mongo_client[DB_NAME]
     try:
         await create_indexes()
         await load_policy_config()
+        await refresh_whitelist()
         LOG.info("Connected to MongoDB%s at %s; DB=%s",
                  " (secure)" if cert_file else "",
                  MONGO_URI,
@@ -368,11 +786,24 @@ async def startup():
     except Exception as e:
         LOG.exception("Failed to connect to MongoDB on startup: %s", e)
         raise
+    write_buffer_full = asyncio.Event()
+    unblock_scheduled = asyncio.Event()
+    background_jobs.append(asyncio.create_task(flush_loop()))
+    background_jobs.append(asyncio.create_task(whitelist_refresh_loop()))
+    background_jobs.append(asyncio.create_task(unblock_reaper()))
 
 @app.on_event("shutdown")
 async def shutdown():
+    for job in background_jobs:
+        job.cancel()
+    close_iptables_pipe()
     if mongo_client:
+        if not await flush_write_buffers():
+            LOG.error("Shutting down with %d buffered docs unwritten",
+                      sum(len(buf) for buf in WRITE_BUFFERS.values()))
         mongo_client.close()
+    CPU_EXEC.shutdown(wait=False, cancel_futures=True)
+    IO_EXEC.shutdown(wait=False, cancel_futures=True)
 
 # ---------- status endpoint ----------
 @app.get("/status")
@@ -399,13 +830,20 @@ async def get_status():
 # ---------- detection endpoint ----------
 @app.post("/detect")
 async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
+    """Score one flow and record it.
+
+    The flow, alert and production_data docs are buffered and written by flush_loop, so ids in the
+    response (alert_id) are eventually consistent: a lookup by that id can miss for up to one
+    flush interval (longer while Mongo writes are being retried).
+    """
     policy = CONFIG_CACHE or {}
     threshold = float(policy.get("threshold", DEFAULT_THRESHOLD))
     block_duration_sec = int(policy.get("block_duration_sec", DEFAULT_BLOCK_DURATION_SEC))
+    now = datetime.utcnow()
 
     # 1) save flow doc
     flow_doc = {
-        "ts_start": datetime.utcnow(),
+        "ts_start": now,
         "src_ip": fv.src_ip,
         "total_packets": fv.total_packets,
         "total_bytes": fv.total_bytes,
@@ -416,25 +854,14 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
         "unique_dst_ports": fv.unique_dst_ports,
         "extra": fv.extra or {}
     }
-    res_flow = await db.flows.insert_one(flow_doc)
-    # include _id in features for traceability
-    flow_doc["_id"] = res_flow.inserted_id
-
-    # 2) prepare dataframe with column names (ensures sklearn works without warnings)
-    df = pd.DataFrame([[fv.total_packets, fv.total_bytes, fv.duration, fv.pkts_per_sec, fv.bytes_per_sec, fv.syn_count, fv.unique_dst_ports]],
-                      columns=FEATURE_ORDER)
-    # run synchronous model in threadpool
-    loop = asyncio.get_running_loop()
-
-    def model_predict(xdf):
-        # ensure returns (pred, prob) where prob is positive-class prob
-        proba = model.predict_proba(xdf)
-        # if model has two columns, second is positive class
-        prob = float(proba[0, 1]) if proba.shape[1] > 1 else float(proba[0, 0])
-        pred = int(model.predict(xdf)[0])
-        return pred, prob
+    # written in the next batch; _id is set now so the alert can reference the flow
+    buffer_insert("flows", flow_doc)
 
-    pred, prob = await loop.run_in_executor(executor, model_predict, df)
+    # 2) score the flow; the batcher stacks concurrent requests into one predict call
+    pred, prob = await submit_for_inference((
+        fv.total_packets, fv.total_bytes, fv.duration, fv.pkts_per_sec,
+        fv.bytes_per_sec, fv.syn_count, fv.unique_dst_ports,
+    ))
 
     is_attack = prob >= threshold
     
@@ -442,11 +869,11 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
     attack_type = classify_attack_type(fv) if is_attack else None
 
     alert_doc = {
-        "detected_at": datetime.utcnow(),
+        "detected_at": now,
         "src_ip": fv.src_ip,
         "features": flow_doc,
         "score": prob,
-        "model_version": os.path.basename(MODEL_PATH),
+        "model_version": MODEL_BASENAME,
         "attack": bool(is_attack),
         "attack_type": attack_type,
         "threshold": threshold,
@@ -454,12 +881,13 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
     }
     
     # Save to production_data collection for future labeling and model improvement
-    # Smart sampling: Only save if attack OR randomly sample 10% of benign traffic to avoid duplicates
-    should_save = is_attack or (prob > 0.15) or (hash(fv.src_ip + str(fv.total_packets)) % 10 == 0)
+    # Smart sampling: Only save if attack OR sample ~1/16 of benign traffic to avoid duplicates.
+    # crc32 (unlike hash()) is stable across restarts, so the same flow is always kept or always skipped.
+    should_save = is_attack or (prob > 0.15) or ((zlib.crc32(fv.src_ip.encode(), fv.total_packets) & 15) == 0)
     
     if should_save:
         production_data_doc = {
-            "collected_at": datetime.utcnow(),
+            "collected_at": now,
             "src_ip": fv.src_ip,
             "features": {
                 "total_packets": fv.total_packets,
@@ -474,7 +902,7 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
                 "score": prob,
                 "is_attack": bool(is_attack),
                 "attack_type": attack_type,
-                "model_version": os.path.basename(MODEL_PATH),
+                "model_version": MODEL_BASENAME,
                 "threshold": threshold,
             },
             # Fields for analyst labeling
@@ -486,18 +914,17 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
             "notes": None,
             "confidence": None,  # Analyst confidence: "high", "medium", "low"
         }
-        await db.production_data.insert_one(production_data_doc)
+        buffer_insert("production_data", production_data_doc)
 
     # 3) on attack: check whitelist, record alert, schedule block
     if alert_doc["attack"]:
-        wl = await db.whitelist.find_one({"ip": fv.src_ip})
-        if wl:
+        if fv.src_ip in WHITELIST:
             alert_doc["note"] = "whitelisted"
             alert_doc["blocked"] = False
-            await db.alerts.insert_one(alert_doc)
+            buffer_insert("alerts", alert_doc)
             return {"alert": False, "score": round(prob,4), "note": "whitelisted"}
         # not whitelisted: insert alert, schedule block (if enabled)
-        res = await db.alerts.insert_one(alert_doc)
+        alert_id = buffer_insert("alerts", alert_doc)
         # schedule blocking & unblock (background task) only if blocking is enabled
         if CONFIG_CACHE.get("blocking_enabled", True):
             background_tasks.add_task(
@@ -508,7 +935,7 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
                 actor="model",
             )
         return {
-            "alert_id": str(res.inserted_id),
+            "alert_id": str(alert_id),
             "alert": True,
             "attack_type": attack_type,
             "score": round(prob,4),
@@ -517,42 +944,30 @@ async def detect(fv: FeatureVec, background_tasks: BackgroundTasks):
         }
     else:
         # benign -> just store alert doc
-        await db.alerts.insert_one(alert_doc)
+        buffer_insert("alerts", alert_doc)
         return {"alert": False, "score": round(prob,4), "threshold": threshold}
 
 # ---------- helper endpoints ----------
 @app.get("/alerts/recent")
 async def recent_alerts(limit: int = 20):
     cursor = db.alerts.find().sort("detected_at", -1).limit(limit)
-    out = []
-    async for d in cursor:
-        out.append(make_jsonable(d))
-    return out
+    return json_response(await cursor.to_list(None))
 
 @app.get("/blocked")
 async def blocked_list(limit: int = 100):
     cursor = db.blocked_ips.find().sort("blocked_at", -1).limit(limit)
-    out = []
-    async for d in cursor:
-        out.append(make_jsonable(d))
-    return out
+    return json_response(await cursor.to_list(None))
 
 @app.get("/blocked/history")
 async def blocked_history(limit: int = 5000):
     """Get full block history (including expired blocks)"""
     cursor = db.blocked_ips_history.find().sort("blocked_at", -1).limit(limit)
-    out = []
-    async for d in cursor:
-        out.append(make_jsonable(d))
-    return out
+    return json_response(await cursor.to_list(None))
 
 @app.get("/whitelist")
 async def get_whitelist(limit: int = 100, admin: bool = Depends(require_admin_token)):
     cursor = db.whitelist.find().sort("created_at", -1).limit(limit)
-    out = []
-    async for doc in cursor:
-        out.append(make_jsonable(doc))
-    return out
+    return json_response(await cursor.to_list(None))
 
 
 @app.post("/whitelist/add")
@@ -564,7 +979,7 @@ async def add_whitelist(entry: IPNote, admin: bool = Depends(require_admin_token
             {"$set": {"note": note, "created_at": datetime.utcnow()}},
             upsert=True,
         )
-        CONFIG_CACHE.setdefault("whitelist_cache_bust", datetime.utcnow().isoformat())
+        await refresh_whitelist()
         return {"ok": True, "upserted": str(res.upserted_id) if res.upserted_id else None}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -573,6 +988,7 @@ async def add_whitelist(entry: IPNote, admin: bool = Depends(require_admin_token
 @app.delete("/whitelist/{ip}")
 async def remove_whitelist(ip: str, admin: bool = Depends(require_admin_token)):
     res = await db.whitelist.delete_one({"ip": ip})
+    await refresh_whitelist()
     return {"ok": True, "deleted": res.deleted_count}
 
 
@@ -600,7 +1016,7 @@ async def manual_unblock(ip: str, admin: bool = Depends(require_admin_token)):
 
 @app.get("/admin/config")
 async def get_config(admin: bool = Depends(require_admin_token)):
-    return make_jsonable(dict(CONFIG_CACHE))
+    return json_response(CONFIG_CACHE)
 
 
 @app.post("/admin/config")
@@ -616,7 +1032,7 @@ async def update_config(payload: ConfigUpdate, admin: bool = Depends(require_adm
         updates["block_duration_sec"] = int(payload.block_duration_sec)
 
     if not updates:
-        return {"ok": True, "config": make_jsonable(dict(CONFIG_CACHE))}
+        return json_response({"ok": True, "config": CONFIG_CACHE})
 
     updates["updated_at"] = datetime.utcnow()
     try:
@@ -625,11 +1041,21 @@ async def update_config(payload: ConfigUpdate, admin: bool = Depends(require_adm
         raise HTTPException(status_code=500, detail=str(exc))
 
     CONFIG_CACHE.update(updates)
-    return {"ok": True, "config": make_jsonable(dict(CONFIG_CACHE))}
+    return json_response({"ok": True, "config": CONFIG_CACHE})
 
 # ---------- admin export (CSV) ----------
 from fastapi.responses import StreamingResponse
 
+CSV_CHUNK_CHARS = 64 * 1024  # export rows are batched into ~64 KiB chunks before being sent
+
+
+def drain(buf: io.StringIO) -> str:
+    """Return what the csv writer put in buf, leaving buf empty for reuse."""
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate(0)
+    return data
+
 @app.get("/admin/export_flows")
 async def export_flows(limit: int = 0, admin: bool = Depends(require_admin_token)):
     """
@@ -644,20 +1070,28 @@ async def export_flows(limit: int = 0, admin: bool = Depends(require_admin_token
     ]
 
     async def generator():
-        # yield header row
-        yield (",".join(header) + "\n").encode()
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(header)
 
-        cursor = db.flows.find().sort("ts_start", 1)
+        # join each flow to the alert referencing it server-side instead of one find_one per row
+        pipeline = [{"$sort": {"ts_start": 1}}]
         if limit and int(limit) > 0:
-            cursor = cursor.limit(int(limit))
+            pipeline.append({"$limit": int(limit)})
+        pipeline.append({"$lookup": {
+            "from": "alerts",
+            "localField": "_id",
+            "foreignField": "features._id",
+            "as": "alert",
+        }})
+        cursor = db.flows.aggregate(pipeline, allowDiskUse=True, batchSize=1000)
 
         async for flow in cursor:
-            # try to find an alert referencing this flow
-            alert = await db.alerts.find_one({"features._id": flow.get("_id")})
-            label = "1" if alert else "0"
+            alert = flow["alert"][0] if flow["alert"] else None
+            label = 1 if alert else 0
             alert_id = str(alert["_id"]) if alert else ""
-            alert_score = str(alert.get("score", "")) if alert else ""
-            detected_at = alert.get("detected_at", "")
+            alert_score = alert.get("score", "") if alert else ""
+            detected_at = alert.get("detected_at", "") if alert else ""
             if hasattr(detected_at, "isoformat"):
                 detected_at = detected_at.isoformat()
 
@@ -666,37 +1100,52 @@ async def export_flows(limit: int = 0, admin: bool = Depends(require_admin_token
                 v = flow.get(k, "")
                 if hasattr(v, "isoformat"):
                     v = v.isoformat()
-                row_vals.append(str(v))
-            row_vals += [str(flow.get("_id","")), label, alert_id, alert_score, str(detected_at)]
-            yield (",".join(row_vals) + "\n").encode()
+                row_vals.append(v)
+            row_vals += [str(flow.get("_id","")), label, alert_id, alert_score, detected_at]
+            writer.writerow(row_vals)
+            if buf.tell() >= CSV_CHUNK_CHARS:
+                yield drain(buf).encode()
+        yield drain(buf).encode()
 
     headers = {
         "Content-Disposition": 'attachment; filename="flows_export.csv"'
     }
-    return StreamingResponse(generator(), media_type="text/csv", headers=headers)
+    return StreamingResponse(generator(), media_type="text/csv; charset=utf-8", headers=headers)
 
 
 # ---------- Production Data Collection Endpoints ----------
 @app.get("/production_data/stats")
 async def get_production_data_stats():
     """Get statistics about collected production data."""
-    total = await db.production_data.count_documents({})
-    labeled = await db.production_data.count_documents({"labeled": True})
+    # All counters in one collection pass instead of five count_documents scans
+    def count_if(expr):
+        return {"$sum": {"$cond": [expr, 1, 0]}}
+
+    pipeline = [{"$group": {
+        "_id": None,
+        "total": {"$sum": 1},
+        "labeled": count_if({"$eq": ["$labeled", True]}),
+        "predicted_attacks": count_if({"$eq": ["$prediction.is_attack", True]}),
+        "true_attacks": count_if({"$eq": ["$true_label", "attack"]}),
+        "true_benign": count_if({"$eq": ["$true_label", "benign"]}),
+    }}]
+    counts = (await db.production_data.aggregate(pipeline).to_list(None) or [{}])[0]
+    total = counts.get("total", 0)
+    labeled = counts.get("labeled", 0)
     unlabeled = total - labeled
     
-    predicted_attacks = await db.production_data.count_documents({"prediction.is_attack": True})
+    predicted_attacks = counts.get("predicted_attacks", 0)
     predicted_benign = total - predicted_attacks
     
-    true_attacks = await db.production_data.count_documents({"true_label": "attack"})
-    true_benign = await db.production_data.count_documents({"true_label": "benign"})
+    true_attacks = counts.get("true_attacks", 0)
+    true_benign = counts.get("true_benign", 0)
     
     # Recent samples
-    recent = []
-    cursor = db.production_data.find().sort("collected_at", -1).limit(10)
-    async for doc in cursor:
-        recent.append(make_jsonable(doc))
+    recent = await db.production_data.find(
+        {}, {"collected_at": 1, "src_ip": 1, "labeled": 1, "prediction": 1}
+    ).sort("collected_at", -1).limit(10).to_list(None)
     
-    return {
+    return json_response({
         "total": total,
         "labeled": labeled,
         "unlabeled": unlabeled,
@@ -705,7 +1154,7 @@ async def get_production_data_stats():
         "true_attacks": true_attacks,
         "true_benign": true_benign,
         "recent_samples": recent,
-    }
+    })
 
 
 @app.get("/production_data/unlabeled")
@@ -719,12 +1168,11 @@ async def get_unlabeled_samples(limit: int = 20, skip: int = 0,
     elif filter_type == "benign":
         query["prediction.is_attack"] = False
     
-    cursor = db.production_data.find(query).sort("collected_at", -1).skip(skip).limit(limit)
-    samples = []
-    async for doc in cursor:
-        samples.append(make_jsonable(doc))
+    projection = {"collected_at": 1, "src_ip": 1, "features": 1, "prediction": 1}
+    cursor = db.production_data.find(query, projection).sort("collected_at", -1).skip(skip).limit(limit)
+    samples = await cursor.to_list(None)
     
-    return {"samples": samples, "count": len(samples)}
+    return json_response({"samples": samples, "count": len(samples)})
 
 
 @app.post("/production_data/label/{sample_id}")
@@ -761,8 +1209,6 @@ async def label_sample(sample_id: str, payload: dict):
 @app.get("/production_data/export")
 async def export_production_data(min_confidence: str = "low"):
     """Export labeled production data as CSV."""
-    import io
-    
     # Confidence filter
     confidence_levels = {'high': 3, 'medium': 2, 'low': 1}
     min_conf_value = confidence_levels.get(min_confidence, 1)
@@ -776,32 +1222,42 @@ async def export_production_data(min_confidence: str = "low"):
     
     # Generate CSV
     async def gen_csv():
-        yield "src_ip,total_packets,total_bytes,duration,pkts_per_sec,bytes_per_sec,syn_count,unique_dst_ports,label,attack_type,model_prediction,model_score,confidence,labeled_by,labeled_at,notes\n"
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow([
+            "src_ip", "total_packets", "total_bytes", "duration", "pkts_per_sec", "bytes_per_sec",
+            "syn_count", "unique_dst_ports", "label", "attack_type", "model_prediction", "model_score",
+            "confidence", "labeled_by", "labeled_at", "notes",
+        ])
         
         async for sample in cursor:
             features = sample['features']
             prediction = sample['prediction']
             
+            # csv.writer quotes commas/newlines in free text and writes None as ''
             row = [
                 sample['src_ip'],
-                str(features['total_packets']),
-                str(features['total_bytes']),
-                str(features['duration']),
-                str(features['pkts_per_sec']),
-                str(features['bytes_per_sec']),
-                str(features['syn_count']),
-                str(features['unique_dst_ports']),
-                sample.get('true_label', ''),
-                sample.get('true_attack_type', ''),
-                str(prediction['is_attack']),
-                str(prediction['score']),
-                sample.get('confidence', ''),
-                sample.get('labeled_by', ''),
-                sample.get('labeled_at', '').isoformat() if sample.get('labeled_at') else '',
-                sample.get('notes', '').replace(',', ';'),  # Escape commas
+                features['total_packets'],
+                features['total_bytes'],
+                features['duration'],
+                features['pkts_per_sec'],
+                features['bytes_per_sec'],
+                features['syn_count'],
+                features['unique_dst_ports'],
+                sample.get('true_label'),
+                sample.get('true_attack_type'),
+                prediction['is_attack'],
+                prediction['score'],
+                sample.get('confidence'),
+                sample.get('labeled_by'),
+                sample['labeled_at'].isoformat() if sample.get('labeled_at') else '',
+                sample.get('notes'),
             ]
-            yield ','.join(row) + '\n'
+            writer.writerow(row)
+            if buf.tell() >= CSV_CHUNK_CHARS:
+                yield drain(buf).encode()
+        yield drain(buf).encode()
     
-    return StreamingResponse(gen_csv(), media_type="text/csv", headers={
+    return StreamingResponse(gen_csv(), media_type="text/csv; charset=utf-8", headers={
         "Content-Disposition": f"attachment; filename=labeled_production_data.csv"
     })
@@ -12,43 +12,44 @@ Usage:
     
     # Export labeled data
     python api/label_data.py export --output data/labeled_production.csv
+    python api/label_data.py export --workers 8   # parallel _id-range scan for large collections
     
     # Get statistics
     python api/label_data.py stats
 """
 import os
 import sys
-import asyncio
+import atexit
+import csv
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
 import click
-from bson import ObjectId
 from typing import Optional
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("IDS_DB", "idsdb")
+LABEL_FLUSH_EVERY = 20  # labels sent per bulk_write during an interactive session
+# Docs per getMore while exporting: smaller means more round trips, larger means more buffered memory
+EXPORT_BATCH_SIZE = 500
 
 
-def make_jsonable(doc):
-    """Convert MongoDB doc to JSON-serializable format."""
-    if isinstance(doc, dict):
-        return {k: make_jsonable(v) for k, v in doc.items()}
-    elif isinstance(doc, list):
-        return [make_jsonable(i) for i in doc]
-    elif isinstance(doc, ObjectId):
-        return str(doc)
-    elif isinstance(doc, datetime):
-        return doc.isoformat()
-    return doc
+_client: Optional[MongoClient] = None
 
 
-async def get_db():
-    """Get database connection."""
-    client = AsyncIOMotorClient(MONGO_URI)
-    return client[DB_NAME]
+def get_db():
+    """Get database connection (one MongoClient per process, closed at exit)."""
+    global _client
+    if _client is None:
+        _client = MongoClient(MONGO_URI, maxPoolSize=16)
+        atexit.register(_client.close)
+    return _client[DB_NAME]
 
 
 @click.group()
@@ -63,12 +64,12 @@ def cli():
               help='Filter samples to label')
 def label(limit, filter):
     """Interactive CLI labeling tool."""
-    asyncio.run(label_interactive(limit, filter))
+    label_interactive(limit, filter)
 
 
-async def label_interactive(limit: int, filter_type: str):
+def label_interactive(limit: int, filter_type: str):
     """Interactive labeling session."""
-    db = await get_db()
+    db = get_db()
     
     # Build query based on filter
     query = {}
@@ -81,8 +82,13 @@ async def label_interactive(limit: int, filter_type: str):
         query['prediction.is_attack'] = False
         query['labeled'] = False
     
-    cursor = db.production_data.find(query).sort("collected_at", -1).limit(limit)
-    samples = await cursor.to_list(length=limit)
+    # Only the fields shown to the analyst; sorted via the (labeled, collected_at) indexes from api/app.py.
+    # A typical session fits in one batch (every sample gets shown); large --limit values are
+    # fetched 100 at a time so the first sample doesn't wait for the whole session.
+    projection = {"_id": 1, "collected_at": 1, "src_ip": 1, "features": 1, "prediction": 1}
+    cursor = (db.production_data.find(query, projection)
+              .sort("collected_at", -1).limit(limit).batch_size(min(limit, 100)))
+    samples = list(cursor)
     
     if not samples:
         click.echo(f"No {filter_type} samples found to label.")
@@ -94,113 +100,195 @@ async def label_interactive(limit: int, filter_type: str):
     
     labeled_count = 0
     
-    for idx, sample in enumerate(samples, 1):
-        click.echo(f"\n--- Sample {idx}/{len(samples)} ---")
-        click.echo(f"ID: {sample['_id']}")
-        click.echo(f"Collected: {sample['collected_at']}")
-        click.echo(f"Source IP: {sample['src_ip']}")
-        click.echo(f"\nFeatures:")
-        for k, v in sample['features'].items():
-            click.echo(f"  {k}: {v}")
-        
-        click.echo(f"\nModel Prediction:")
-        click.echo(f"  Attack: {sample['prediction']['is_attack']}")
-        click.echo(f"  Score: {sample['prediction']['score']:.4f}")
-        click.echo(f"  Attack Type: {sample['prediction'].get('attack_type', 'N/A')}")
-        
-        click.echo(f"\n{'='*80}")
-        
-        # Get analyst label
-        while True:
-            label_input = click.prompt(
-                "\nTrue label? [a=attack, b=benign, s=skip, q=quit]",
-                type=str,
-                default='s'
-            ).lower()
+    # Labels are queued and written in batches; the finally flushes the rest on q, Ctrl-C or an error
+    pending = []
+    try:
+        for idx, sample in enumerate(samples, 1):
+            click.echo(f"\n--- Sample {idx}/{len(samples)} ---")
+            click.echo(f"ID: {sample['_id']}")
+            click.echo(f"Collected: {sample['collected_at']}")
+            click.echo(f"Source IP: {sample['src_ip']}")
+            click.echo(f"\nFeatures:")
+            for k, v in sample['features'].items():
+                click.echo(f"  {k}: {v}")
             
-            if label_input == 'q':
-                click.echo(f"\nLabeled {labeled_count} samples in this session.")
-                return
-            elif label_input == 's':
-                break
-            elif label_input in ['a', 'b']:
-                true_label = 'attack' if label_input == 'a' else 'benign'
+            click.echo(f"\nModel Prediction:")
+            click.echo(f"  Attack: {sample['prediction']['is_attack']}")
+            click.echo(f"  Score: {sample['prediction']['score']:.4f}")
+            click.echo(f"  Attack Type: {sample['prediction'].get('attack_type', 'N/A')}")
+            
+            click.echo(f"\n{'='*80}")
+            
+            # Get analyst label
+            while True:
+                label_input = click.prompt(
+                    "\nTrue label? [a=attack, b=benign, s=skip, q=quit]",
+                    type=str,
+                    default='s'
+                ).lower()
                 
-                # If attack, get attack type
-                true_attack_type = None
-                if true_label == 'attack':
-                    click.echo("\nAttack Types:")
-                    click.echo("  1. Port Scan")
-                    click.echo("  2. DDoS")
-                    click.echo("  3. Brute Force")
-                    click.echo("  4. Bot")
-                    click.echo("  5. Suspicious Activity")
-                    click.echo("  6. Other")
+                if label_input == 'q':
+                    click.echo(f"\nLabeled {labeled_count} samples in this session.")
+                    return
+                elif label_input == 's':
+                    break
+                elif label_input in ['a', 'b']:
+                    true_label = 'attack' if label_input == 'a' else 'benign'
+                    
+                    # If attack, get attack type
+                    true_attack_type = None
+                    if true_label == 'attack':
+                        click.echo("\nAttack Types:")
+                        click.echo("  1. Port Scan")
+                        click.echo("  2. DDoS")
+                        click.echo("  3. Brute Force")
+                        click.echo("  4. Bot")
+                        click.echo("  5. Suspicious Activity")
+                        click.echo("  6. Other")
+                        
+                        attack_type_map = {
+                            '1': 'Port Scan',
+                            '2': 'DDoS',
+                            '3': 'Brute Force',
+                            '4': 'Bot',
+                            '5': 'Suspicious Activity',
+                            '6': 'Other'
+                        }
+                        
+                        attack_choice = click.prompt("Select attack type [1-6]", type=str, default='5')
+                        true_attack_type = attack_type_map.get(attack_choice, 'Suspicious Activity')
+                    
+                    # Get confidence
+                    confidence_input = click.prompt(
+                        "Confidence? [h=high, m=medium, l=low]",
+                        type=str,
+                        default='h'
+                    ).lower()
+                    confidence = {'h': 'high', 'm': 'medium', 'l': 'low'}.get(confidence_input, 'high')
                     
-                    attack_type_map = {
-                        '1': 'Port Scan',
-                        '2': 'DDoS',
-                        '3': 'Brute Force',
-                        '4': 'Bot',
-                        '5': 'Suspicious Activity',
-                        '6': 'Other'
+                    # Get notes (optional)
+                    notes = click.prompt("Notes (optional)", type=str, default='', show_default=False)
+                    
+                    # Update database
+                    update_doc = {
+                        "labeled": True,
+                        "true_label": true_label,
+                        "true_attack_type": true_attack_type,
+                        "labeled_by": os.getenv("USER", "analyst"),
+                        "labeled_at": datetime.utcnow(),
+                        "confidence": confidence,
+                        "notes": notes if notes else None,
                     }
                     
-                    attack_choice = click.prompt("Select attack type [1-6]", type=str, default='5')
-                    true_attack_type = attack_type_map.get(attack_choice, 'Suspicious Activity')
-                
-                # Get confidence
-                confidence_input = click.prompt(
-                    "Confidence? [h=high, m=medium, l=low]",
-                    type=str,
-                    default='h'
-                ).lower()
-                confidence = {'h': 'high', 'm': 'medium', 'l': 'low'}.get(confidence_input, 'high')
-                
-                # Get notes (optional)
-                notes = click.prompt("Notes (optional)", type=str, default='', show_default=False)
-                
-                # Update database
-                update_doc = {
-                    "labeled": True,
-                    "true_label": true_label,
-                    "true_attack_type": true_attack_type,
-                    "labeled_by": os.getenv("USER", "analyst"),
-                    "labeled_at": datetime.utcnow(),
-                    "confidence": confidence,
-                    "notes": notes if notes else None,
-                }
-                
-                await db.production_data.update_one(
-                    {"_id": sample["_id"]},
-                    {"$set": update_doc}
-                )
-                
-                labeled_count += 1
-                click.echo(f"✓ Labeled as {true_label.upper()}")
-                break
-            else:
-                click.echo("Invalid input. Use a/b/s/q")
+                    pending.append(UpdateOne({"_id": sample["_id"]}, {"$set": update_doc}))
+                    if len(pending) >= LABEL_FLUSH_EVERY:
+                        flush_labels(db, pending)
+                    
+                    labeled_count += 1
+                    click.echo(f"✓ Labeled as {true_label.upper()}")
+                    break
+                else:
+                    click.echo("Invalid input. Use a/b/s/q")
+    finally:
+        flush_labels(db, pending)
     
     click.echo(f"\n{'='*80}")
     click.echo(f"Session complete! Labeled {labeled_count} samples.")
     click.echo(f"{'='*80}\n")
 
 
+def flush_labels(db, pending: list):
+    """Write queued label updates in one round trip."""
+    if pending:
+        db.production_data.bulk_write(pending, ordered=False)
+        pending.clear()
+
+
 @cli.command()
 @click.option('--output', default='data/labeled_production.csv', help='Output CSV file path')
 @click.option('--min-confidence', type=click.Choice(['high', 'medium', 'low']), default='low',
               help='Minimum confidence level to include')
-def export(output, min_confidence):
+@click.option('--workers', default=1, help='Parallel cursors, each scanning one _id range (1 = single cursor)')
+def export(output, min_confidence, workers):
     """Export labeled data to CSV for model training."""
-    asyncio.run(export_labeled_data(output, min_confidence))
+    export_labeled_data(output, min_confidence, workers)
+
 
+def split_id_ranges(db, query: dict, shards: int) -> list:
+    """Split query into ~equal-sized _id ranges with $bucketAuto, one query per range."""
+    buckets = list(db.production_data.aggregate([
+        {"$match": query},
+        {"$bucketAuto": {"groupBy": "$_id", "buckets": shards}},
+    ]))
+    queries = []
+    for i, bucket in enumerate(buckets):
+        # bucket max is the next bucket's min, except for the last one where it is inclusive
+        upper = "$lte" if i == len(buckets) - 1 else "$lt"
+        queries.append({**query, "_id": {"$gte": bucket["_id"]["min"], upper: bucket["_id"]["max"]}})
+    return queries
 
-async def export_labeled_data(output_path: str, min_confidence: str):
-    """Export labeled production data to CSV."""
-    import pandas as pd
+
+def scan_samples(db, query: dict, workers: int = 1):
+    """Yield docs matching query, from `workers` parallel range cursors when workers > 1 (unordered)."""
+    if workers <= 1:
+        yield from db.production_data.find(query).batch_size(EXPORT_BATCH_SIZE)
+        return
     
-    db = await get_db()
+    shard_queries = split_id_ranges(db, query, workers)
+    # bounded so fast shards can't buffer the whole collection ahead of the writer
+    batches = queue.Queue(maxsize=2 * workers)
+    stop = threading.Event()  # set once the consumer is done, including an abandoned export
+    
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def scan(shard_query):
+        try:
+            batch = []
+            for doc in db.production_data.find(shard_query).batch_size(EXPORT_BATCH_SIZE):
+                if stop.is_set():
+                    return
+                batch.append(doc)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch:
+                put(batch)
+        finally:
+            put(None)  # this shard is done
+    
+    with ThreadPoolExecutor(max_workers=len(shard_queries)) as pool:
+        futures = [pool.submit(scan, q) for q in shard_queries]
+        try:
+            remaining = len(futures)
+            while remaining:
+                batch = batches.get()
+                if batch is None:
+                    remaining -= 1
+                    continue
+                yield from batch
+        finally:
+            stop.set()
+        for fut in futures:
+            fut.result()  # surface scan errors
+
+EXPORT_COLUMNS = [
+    'src_ip', 'total_packets', 'total_bytes', 'duration', 'pkts_per_sec', 'bytes_per_sec',
+    'syn_count', 'unique_dst_ports', 'label', 'attack_type', 'model_prediction', 'model_score',
+    'confidence', 'labeled_by', 'labeled_at', 'notes',
+]
+
+
+def export_labeled_data(output_path: str, min_confidence: str, workers: int = 1):
+    """Export labeled production data to CSV, streaming rows from the cursor."""
+    db = get_db()
     
     # Confidence hierarchy
     confidence_levels = {'high': 3, 'medium': 2, 'low': 1}
@@ -212,62 +300,66 @@ async def export_labeled_data(output_path: str, min_confidence: str):
         "confidence": {"$in": [k for k, v in confidence_levels.items() if v >= min_conf_value]}
     }
     
-    cursor = db.production_data.find(query)
-    samples = await cursor.to_list(length=None)
-    
-    if not samples:
+    # Create output directory if needed
+    out_dir = os.path.dirname(output_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    
+    # Stats are accumulated while writing: confusion[true_is_attack][predicted_is_attack]
+    total = 0
+    confusion = [[0, 0], [0, 0]]
+    label_counts = Counter()
+    confidence_counts = Counter()
+    
+    with open(output_path, 'w', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for sample in scan_samples(db, query, workers):
+            features = sample['features']
+            prediction = sample['prediction']
+            writer.writerow([
+                sample['src_ip'],
+                features['total_packets'],
+                features['total_bytes'],
+                features['duration'],
+                features['pkts_per_sec'],
+                features['bytes_per_sec'],
+                features['syn_count'],
+                features['unique_dst_ports'],
+                sample['true_label'],
+                sample.get('true_attack_type', ''),
+                prediction['is_attack'],
+                prediction['score'],
+                sample['confidence'],
+                sample['labeled_by'],
+                sample['labeled_at'].isoformat() if sample['labeled_at'] else '',
+                sample.get('notes', ''),
+            ])
+            total += 1
+            label_counts[sample['true_label']] += 1
+            confidence_counts[sample['confidence']] += 1
+            confusion[sample['true_label'] == 'attack'][prediction['is_attack'] is True] += 1
+    
+    if not total:
+        os.remove(output_path)
         click.echo("No labeled data found to export.")
         return
     
-    # Convert to DataFrame format
-    rows = []
-    for sample in samples:
-        row = {
-            'src_ip': sample['src_ip'],
-            'total_packets': sample['features']['total_packets'],
-            'total_bytes': sample['features']['total_bytes'],
-            'duration': sample['features']['duration'],
-            'pkts_per_sec': sample['features']['pkts_per_sec'],
-            'bytes_per_sec': sample['features']['bytes_per_sec'],
-            'syn_count': sample['features']['syn_count'],
-            'unique_dst_ports': sample['features']['unique_dst_ports'],
-            'label': sample['true_label'],
-            'attack_type': sample.get('true_attack_type', ''),
-            'model_prediction': sample['prediction']['is_attack'],
-            'model_score': sample['prediction']['score'],
-            'confidence': sample['confidence'],
-            'labeled_by': sample['labeled_by'],
-            'labeled_at': sample['labeled_at'].isoformat() if sample['labeled_at'] else '',
-            'notes': sample.get('notes', ''),
-        }
-        rows.append(row)
-    
-    df = pd.DataFrame(rows)
-    
-    # Create output directory if needed
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    # Save to CSV
-    df.to_csv(output_path, index=False)
-    
-    click.echo(f"\n✓ Exported {len(df)} labeled samples to {output_path}")
+    click.echo(f"\n✓ Exported {total} labeled samples to {output_path}")
     click.echo(f"\nBreakdown:")
-    click.echo(f"  Attacks: {len(df[df['label'] == 'attack'])}")
-    click.echo(f"  Benign: {len(df[df['label'] == 'benign'])}")
+    click.echo(f"  Attacks: {label_counts['attack']}")
+    click.echo(f"  Benign: {label_counts['benign']}")
     click.echo(f"\nConfidence:")
-    click.echo(df['confidence'].value_counts().to_string())
+    for conf, count in confidence_counts.most_common():
+        click.echo(f"  {conf}: {count}")
+    
+    (tn, fp), (fn, tp) = confusion
     
     # Calculate model accuracy on labeled data
-    df['correct'] = ((df['label'] == 'attack') == df['model_prediction'])
-    accuracy = df['correct'].mean() * 100
+    accuracy = (tp + tn) / total * 100
     click.echo(f"\nModel accuracy on labeled data: {accuracy:.2f}%")
     
     # Show confusion matrix
-    tp = len(df[(df['label'] == 'attack') & (df['model_prediction'] == True)])
-    fp = len(df[(df['label'] == 'benign') & (df['model_prediction'] == True)])
-    tn = len(df[(df['label'] == 'benign') & (df['model_prediction'] == False)])
-    fn = len(df[(df['label'] == 'attack') & (df['model_prediction'] == False)])
-    
     click.echo(f"\nConfusion Matrix:")
     click.echo(f"  True Positives (Attacks correctly detected): {tp}")
     click.echo(f"  False Positives (Benign flagged as attack): {fp}")
@@ -285,25 +377,56 @@ async def export_labeled_data(output_path: str, min_confidence: str):
 @cli.command()
 def stats():
     """Show statistics about production data collection."""
-    asyncio.run(show_statistics())
+    show_statistics()
 
 
-async def show_statistics():
+def show_statistics():
     """Display statistics about collected production data."""
-    db = await get_db()
+    db = get_db()
     
-    # Total samples
-    total = await db.production_data.count_documents({})
-    labeled = await db.production_data.count_documents({"labeled": True})
+    # Every counter in one round trip; the labeled-only breakdowns are computed server-side
+    # instead of pulling all labeled docs into the client
+    def count_if(expr):
+        return {"$sum": {"$cond": [expr, 1, 0]}}
+
+    pipeline = [{"$facet": {
+        "totals": [{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "labeled": count_if({"$eq": ["$labeled", True]}),
+            "predicted_attacks": count_if({"$eq": ["$prediction.is_attack", True]}),
+            "true_attacks": count_if({"$eq": ["$true_label", "attack"]}),
+            "true_benign": count_if({"$eq": ["$true_label", "benign"]}),
+            "agree": count_if({"$and": [
+                {"$eq": ["$labeled", True]},
+                {"$eq": [{"$eq": ["$true_label", "attack"]}, "$prediction.is_attack"]},
+            ]}),
+        }}],
+        "by_attack_type": [
+            {"$match": {"labeled": True, "true_attack_type": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$true_attack_type", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ],
+        "by_confidence": [
+            {"$match": {"labeled": True}},
+            {"$group": {"_id": {"$ifNull": ["$confidence", "unknown"]}, "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+        ],
+    }}]
+    result = next(db.production_data.aggregate(pipeline))
+    totals = result["totals"][0] if result["totals"] else {}
+    
+    total = totals.get("total", 0)
+    labeled = totals.get("labeled", 0)
     unlabeled = total - labeled
     
     # Predicted attacks vs benign
-    predicted_attacks = await db.production_data.count_documents({"prediction.is_attack": True})
+    predicted_attacks = totals.get("predicted_attacks", 0)
     predicted_benign = total - predicted_attacks
     
     # True labels (from analyst labeling)
-    true_attacks = await db.production_data.count_documents({"true_label": "attack"})
-    true_benign = await db.production_data.count_documents({"true_label": "benign"})
+    true_attacks = totals.get("true_attacks", 0)
+    true_benign = totals.get("true_benign", 0)
     
     click.echo(f"\n{'='*80}")
     click.echo("Production Data Collection Statistics")
@@ -323,38 +446,22 @@ async def show_statistics():
         click.echo(f"  True Benign: {true_benign}")
         
         # Calculate agreement
-        cursor = db.production_data.find({"labeled": True})
-        samples = await cursor.to_list(length=None)
+        agreement = totals.get("agree", 0) / labeled * 100
+        click.echo(f"\nModel-Analyst Agreement: {agreement:.2f}%")
         
-        if samples:
-            correct = sum(1 for s in samples if 
-                         (s['true_label'] == 'attack') == s['prediction']['is_attack'])
-            agreement = correct / len(samples) * 100
-            click.echo(f"\nModel-Analyst Agreement: {agreement:.2f}%")
-            
-            # Attack type breakdown
-            attack_types = {}
-            for s in samples:
-                if s.get('true_attack_type'):
-                    attack_types[s['true_attack_type']] = attack_types.get(s['true_attack_type'], 0) + 1
-            
-            if attack_types:
-                click.echo(f"\nAttack Type Distribution:")
-                for atype, count in sorted(attack_types.items(), key=lambda x: x[1], reverse=True):
-                    click.echo(f"  {atype}: {count}")
-            
-            # Confidence breakdown
-            confidence_breakdown = {}
-            for s in samples:
-                conf = s.get('confidence', 'unknown')
-                confidence_breakdown[conf] = confidence_breakdown.get(conf, 0) + 1
-            
-            click.echo(f"\nConfidence Levels:")
-            for conf, count in sorted(confidence_breakdown.items()):
-                click.echo(f"  {conf.capitalize()}: {count}")
+        # Attack type breakdown
+        if result["by_attack_type"]:
+            click.echo(f"\nAttack Type Distribution:")
+            for d in result["by_attack_type"]:
+                click.echo(f"  {d['_id']}: {d['count']}")
+        
+        # Confidence breakdown
+        click.echo(f"\nConfidence Levels:")
+        for d in result["by_confidence"]:
+            click.echo(f"  {d['_id'].capitalize()}: {d['count']}")
     
     # Recent activity
-    recent_samples = await db.production_data.find().sort("collected_at", -1).limit(5).to_list(5)
+    recent_samples = list(db.production_data.find().sort("collected_at", -1).limit(5))
     
     if recent_samples:
         click.echo(f"\nRecent Samples:")
@@ -3,6 +3,7 @@
 Simple API-based production data tools.
 Works around MongoDB SSL connection issues by using the API.
 """
+import os
 import requests
 import click
 import json
@@ -67,20 +68,22 @@ def stats():
 @click.option('--min-confidence', default='medium', type=click.Choice(['high', 'medium', 'low']))
 def export(output, min_confidence):
     """Export labeled data to CSV."""
-    import os
-    
     try:
-        response = requests.get(f"{API_URL}/production_data/export", 
-                               params={"min_confidence": min_confidence})
-        response.raise_for_status()
-        
-        # Save CSV
-        os.makedirs(os.path.dirname(output), exist_ok=True)
-        with open(output, 'w') as f:
-            f.write(response.text)
+        # Stream the CSV straight to disk, counting lines as chunks arrive
+        newlines = 0
+        with requests.get(f"{API_URL}/production_data/export",
+                          params={"min_confidence": min_confidence}, stream=True) as response:
+            response.raise_for_status()
+            
+            out_dir = os.path.dirname(output)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            with open(output, 'wb', buffering=1 << 20) as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+                    newlines += chunk.count(b'\n')
         
-        # Count lines
-        lines = response.text.count('\n') - 1  # Subtract header
+        lines = newlines - 1  # Subtract header
         
         print(f"\n✓ Exported {lines} labeled samples to {output}")
         print(f"  Min confidence: {min_confidence}")
@@ -104,5 +107,4 @@ def web():
 
 
 if __name__ == "__main__":
-    import os
     cli()
@@ -1,7 +1,7 @@
 # models/export_flows_from_mongo.py
 """
 Export flows from MongoDB into a CSV for model training.
-It tries to label flows by looking up recent alerts referencing the flow._id.
+It labels flows by joining ($lookup) the alerts referencing the flow._id.
 Usage:
   export MONGO_URI="..." && python models/export_flows_from_mongo.py --out data/flows_labeled.csv --lookback-hours 72
 """
@@ -26,6 +26,7 @@ FEATURE_FIELDS = [
     "unique_dst_ports",
     # add your extra keys here if present: avg_pkt_size, unique_dst_ips, tcp_ack, tcp_rst, tcp_fin
 ]
+TS_IDX = FEATURE_FIELDS.index("ts_start")  # the only datetime field; written as an ISO string
 
 async def run(uri, out_path, lookback_hours):
     client = AsyncIOMotorClient(uri)
@@ -36,33 +37,50 @@ async def run(uri, out_path, lookback_hours):
     if cutoff:
         query["ts_start"] = {"$gte": cutoff}
 
-    cursor = db.flows.find(query).sort("ts_start", 1)
+    # join each flow to the alert referencing it server-side instead of one find_one per flow
+    await db.alerts.create_index([("features._id", 1)])
+    projection = {k: 1 for k in FEATURE_FIELDS}
+    projection.update({"alert._id": 1, "alert.score": 1, "alert.detected_at": 1})
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"ts_start": 1}},
+        {"$lookup": {
+            "from": "alerts",
+            "localField": "_id",
+            "foreignField": "features._id",
+            "as": "alert",
+        }},
+        {"$project": projection},
+    ]
+    cursor = db.flows.aggregate(pipeline, allowDiskUse=True, batchSize=1000)
     print("Exporting flows to", out_path)
-    with open(out_path, "w", newline="") as f:
+    with open(out_path, "w", newline="", buffering=1 << 20) as f:
         writer = csv.writer(f)
         header = FEATURE_FIELDS + ["flow_id", "label", "alert_id", "alert_score", "detected_at"]
         writer.writerow(header)
         i = 0
+        rows = []
         async for flow in cursor:
             flow_id = flow.get("_id")
-            # find alert for this flow (if any). We assume alerts.features._id references flow._id
-            alert = await db.alerts.find_one({"features._id": flow_id})
+            # alert for this flow (if any). We assume alerts.features._id references flow._id
+            alert = flow["alert"][0] if flow["alert"] else None
             label = 1 if alert else 0
             alert_id = str(alert["_id"]) if alert else ""
             alert_score = alert["score"] if alert and "score" in alert else ""
             detected_at = alert["detected_at"].isoformat() if alert and "detected_at" in alert else ""
-            row = []
-            for fkey in FEATURE_FIELDS:
-                val = flow.get(fkey)
-                # normalize datetimes -> iso strings or numeric
-                if getattr(val, "isoformat", None):
-                    val = val.isoformat()
-                row.append(val)
+            row = [flow.get(fkey) for fkey in FEATURE_FIELDS]
+            ts = row[TS_IDX]
+            if ts is not None:
+                row[TS_IDX] = ts.isoformat()
             row += [str(flow_id), label, alert_id, alert_score, detected_at]
-            writer.writerow(row)
+            rows.append(row)
             i += 1
+            if len(rows) >= 1000:
+                writer.writerows(rows)
+                rows.clear()
             if i % 500 == 0:
                 print("Exported", i, "rows")
+        writer.writerows(rows)
     client.close()
     print("Done. exported", i, "rows")
 
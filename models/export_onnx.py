@@ -0,0 +1,46 @@
+# models/export_onnx.py
+"""
+Compile a saved forest to ONNX for the API's INFERENCE_BACKEND=onnx.
+The .onnx file is written next to the joblib model (rf_model.joblib -> rf_model.onnx),
+which is where api/app.py looks for it.
+Usage:
+  python models/export_onnx.py --model models/saved_models/rf_model.joblib
+Requires skl2onnx (onnxruntime is only needed by the API).
+"""
+
+import argparse
+import os
+
+import joblib
+
+
+def onnx_path_for(model_path):
+    return os.path.splitext(model_path)[0] + ".onnx"
+
+
+def export_onnx(model, model_path):
+    """Convert a fitted sklearn classifier and write it beside model_path; returns the .onnx path."""
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+
+    onx = convert_sklearn(
+        model,
+        initial_types=[("input", FloatTensorType([None, model.n_features_in_]))],
+        options={id(model): {"zipmap": False}},  # plain probability matrix, not a list of dicts
+    )
+    out_path = onnx_path_for(model_path)
+    with open(out_path, "wb") as f:
+        f.write(onx.SerializeToString())
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", dest="model_path", default="models/saved_models/rf_model.joblib")
+    args = parser.parse_args()
+    out_path = export_onnx(joblib.load(args.model_path), args.model_path)
+    print("Saved ONNX model to", out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,64 +6,54 @@ Each row has:
 label: 0 = benign, 1 = attack
 This is synthetic and only for learning/testing the pipeline.
 """
-import csv
-import random
-import math
 import os
+import numpy as np
+import pandas as pd
 
 OUT = os.path.join(os.path.dirname(__file__), "..", "data", "synthetic_flows.csv")
 os.makedirs(os.path.dirname(OUT), exist_ok=True)
 
 FIELDNAMES = ["total_packets","total_bytes","duration","pkts_per_sec","bytes_per_sec","syn_count","unique_dst_ports","label"]
+INT_FIELDS = ["total_packets","total_bytes","syn_count","unique_dst_ports","label"]
 
-def make_benign():
+# attack flows: high rates OR high syns OR many ports
+# per-type (low, high) ranges, inclusive; rows are ddos, syn_flood, port_scan
+ATTACK_PACKETS = np.array([(500, 5000), (200, 2000), (50, 600)])
+ATTACK_BYTES_PER_PKT = np.array([(40, 150), (40, 80), (40, 120)])
+ATTACK_DURATION = np.array([(0.5, 10.0), (0.1, 5.0), (0.5, 20.0)])  # seconds
+ATTACK_SYNS = np.array([(0, 10), (50, 500), (5, 50)])
+ATTACK_PORTS = np.array([(1, 5), (1, 3), (20, 200)])
+
+def make_benign(rng, n):
     # benign flows: modest packet rates, few syns, few ports
-    total_packets = random.randint(1, 50)
-    total_bytes = total_packets * random.randint(40, 120)
-    duration = random.uniform(0.5, 60.0)  # seconds
-    pkts_per_sec = total_packets / duration
-    bytes_per_sec = total_bytes / duration
-    syn_count = random.randint(0, 2)
-    unique_dst_ports = random.randint(1, 3)
-    return [total_packets,total_bytes,duration,pkts_per_sec,bytes_per_sec,syn_count,unique_dst_ports,0]
+    total_packets = rng.integers(1, 51, n)
+    total_bytes = total_packets * rng.integers(40, 121, n)
+    duration = rng.uniform(0.5, 60.0, n)  # seconds
+    syn_count = rng.integers(0, 3, n)
+    unique_dst_ports = rng.integers(1, 4, n)
+    return np.column_stack([total_packets, total_bytes, duration, total_packets / duration,
+                            total_bytes / duration, syn_count, unique_dst_ports, np.zeros(n)])
 
-def make_attack():
-    # attack flows: high rates OR high syns OR many ports
-    # Randomly choose type
-    typ = random.choice(["ddos","syn_flood","port_scan"])
-    if typ == "ddos":
-        total_packets = random.randint(500, 5000)
-        total_bytes = total_packets * random.randint(40, 150)
-        duration = random.uniform(0.5, 10.0)
-        syn_count = random.randint(0, 10)
-        unique_dst_ports = random.randint(1, 5)
-    elif typ == "syn_flood":
-        total_packets = random.randint(200, 2000)
-        total_bytes = total_packets * random.randint(40, 80)
-        duration = random.uniform(0.1, 5.0)
-        syn_count = random.randint(50, 500)
-        unique_dst_ports = random.randint(1, 3)
-    else:  # port_scan
-        total_packets = random.randint(50, 600)
-        total_bytes = total_packets * random.randint(40, 120)
-        duration = random.uniform(0.5, 20.0)
-        syn_count = random.randint(5, 50)
-        unique_dst_ports = random.randint(20, 200)
-    pkts_per_sec = total_packets / max(duration, 0.0001)
-    bytes_per_sec = total_bytes / max(duration, 0.0001)
-    return [total_packets,total_bytes,duration,pkts_per_sec,bytes_per_sec,syn_count,unique_dst_ports,1]
+def make_attack(rng, n):
+    # Randomly choose type per row, then draw every column from that type's range
+    typ = rng.integers(0, 3, n)
+    def draw_int(ranges):
+        return rng.integers(ranges[typ, 0], ranges[typ, 1] + 1)
+    total_packets = draw_int(ATTACK_PACKETS)
+    total_bytes = total_packets * draw_int(ATTACK_BYTES_PER_PKT)
+    duration = rng.uniform(ATTACK_DURATION[typ, 0], ATTACK_DURATION[typ, 1])
+    syn_count = draw_int(ATTACK_SYNS)
+    unique_dst_ports = draw_int(ATTACK_PORTS)
+    safe_duration = np.maximum(duration, 0.0001)
+    return np.column_stack([total_packets, total_bytes, duration, total_packets / safe_duration,
+                            total_bytes / safe_duration, syn_count, unique_dst_ports, np.ones(n)])
 
-def generate(n_benign=800, n_attack=200):
-    rows = []
-    for _ in range(n_benign):
-        rows.append(make_benign())
-    for _ in range(n_attack):
-        rows.append(make_attack())
-    random.shuffle(rows)
-    with open(OUT, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(FIELDNAMES)
-        writer.writerows(rows)
+def generate(n_benign=800, n_attack=200, seed=None):
+    rng = np.random.default_rng(seed)
+    rows = np.vstack([make_benign(rng, n_benign), make_attack(rng, n_attack)])
+    rows = rows[rng.permutation(len(rows))]
+    df = pd.DataFrame(rows, columns=FIELDNAMES).astype({c: np.int64 for c in INT_FIELDS})
+    df.to_csv(OUT, index=False, float_format="%.6f")
     print("[+] Wrote", OUT, "rows:", len(rows))
 
 if __name__ == "__main__":
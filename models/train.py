@@ -26,9 +26,20 @@ from sklearn.preprocessing import StandardScaler
 from imblearn.over_sampling import SMOTE
 import joblib
 import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import click
 
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:  # fall back to pandas' C parser
+    pa = None
+
+# forest node arrays compress well; zlib keeps the file loadable without extra packages
+MODEL_COMPRESS = 3
+
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, PROJECT_ROOT)
 
@@ -43,6 +54,75 @@ FEATURE_COLS = [
     "unique_dst_ports"
 ]
 
+# Common CIC column mappings (may vary by dataset version)
+# This is a simplified mapping - adjust based on actual CIC column names
+CIC_MAPPING = {
+    'Total Fwd Packets': 'total_packets',
+    'Total Length of Fwd Packets': 'total_bytes',
+    'Flow Duration': 'duration',
+    'Flow Packets/s': 'pkts_per_sec',
+    'Flow Bytes/s': 'bytes_per_sec',
+    'SYN Flag Count': 'syn_count',
+    'Destination Port': 'unique_dst_ports'
+}
+CIC_LABEL_COLS = ['Label', ' Label']
+CIC_CHUNK_ROWS = 200_000
+
+
+def read_csv_columns(path, usecols, float_cols=(), as_arrow=False):
+    """Read usecols from a CSV (float_cols as float32) with Arrow's multithreaded parser if available.
+
+    With as_arrow=True the pyarrow Table is returned as-is (pyarrow must be installed).
+    """
+    if pa is None:
+        return pd.read_csv(path, usecols=usecols, dtype={c: 'float32' for c in float_cols}, engine='c')
+    table = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(
+        include_columns=usecols,
+        column_types={c: pa.float32() for c in float_cols},
+    ))
+    return table if as_arrow else table.to_pandas()
+
+
+def count_lines(path):
+    """Newline count of a file, read in 1 MiB blocks (an upper bound on its CSV rows)."""
+    with open(path, 'rb') as f:
+        return sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+
+
+def read_csv_files_chunked(files):
+    """Stream (path, usecols, float_cols) CSVs in chunks into preallocated columns.
+
+    Used without pyarrow, where per-file frames plus pd.concat would hold the data twice.
+    Columns missing from a file are NaN for its rows, as with pd.concat.
+    """
+    capacity = sum(count_lines(path) for path, _, _ in files)
+    columns = {}
+    n = 0
+    for path, usecols, float_cols in files:
+        reader = pd.read_csv(path, usecols=usecols, dtype={c: 'float32' for c in float_cols},
+                             engine='c', chunksize=CIC_CHUNK_ROWS)
+        for chunk in reader:
+            for col in chunk.columns:
+                if col not in columns:
+                    dtype = np.float32 if col in float_cols else object
+                    columns[col] = np.full(capacity, np.nan, dtype=dtype)
+                columns[col][n:n + len(chunk)] = chunk[col].to_numpy()
+            n += len(chunk)
+    return pd.DataFrame({col: values[:n] for col, values in columns.items()}, copy=False)
+
+
+def cic_feature_columns(available_cols):
+    """Map each of our feature columns to the CIC column it is read from (None if not found)."""
+    found = {}
+    for cic_col, our_col in CIC_MAPPING.items():
+        if cic_col in available_cols:
+            found[our_col] = cic_col
+        else:
+            # Try to find similar column
+            similar = [c for c in available_cols if our_col.replace('_', '').lower() in c.lower()]
+            found[our_col] = similar[0] if similar else None
+    return found
+
 
 def load_cic_dataset():
     """Load and combine CIC-IDS2017 CSV files."""
@@ -58,14 +138,26 @@ def load_cic_dataset():
         click.echo(f"Warning: No CSV files found in {cic_dir}")
         return None
     
-    dfs = []
+    files = []
     for csv_file in csv_files:
         path = os.path.join(cic_dir, csv_file)
-        click.echo(f"Loading {csv_file}...")
-        df = pd.read_csv(path)
-        dfs.append(df)
-    
-    combined = pd.concat(dfs, ignore_index=True)
+        # only parse the columns prepare_cic_data will use, straight into float32
+        header = pd.read_csv(path, nrows=0).columns.tolist()
+        feature_cols = [c for c in cic_feature_columns(header).values() if c]
+        usecols = list(dict.fromkeys(feature_cols + [c for c in CIC_LABEL_COLS if c in header]))
+        files.append((path, usecols, feature_cols))
+    
+    if pa is not None:
+        click.echo(f"Loading {', '.join(csv_files)}...")
+        # Arrow parses with the GIL released, so files are read (and decoded) concurrently
+        with ThreadPoolExecutor(max_workers=min(8, len(files))) as pool:
+            parts = list(pool.map(lambda f: read_csv_columns(*f, as_arrow=True), files))
+        # concat_tables only stitches chunk lists (no copy); a single conversion then builds the
+        # DataFrame, releasing Arrow buffers as it goes, instead of pd.concat copying every column
+        combined = pa.concat_tables(parts, promote_options="default").to_pandas(self_destruct=True)
+    else:
+        click.echo(f"Loading {', '.join(csv_files)}...")
+        combined = read_csv_files_chunked(files)
     click.echo(f"Loaded {len(combined)} samples from CIC-IDS2017 dataset")
     
     return combined
@@ -74,41 +166,23 @@ def load_cic_dataset():
 def prepare_cic_data(df):
     """Prepare CIC dataset to match our feature format."""
     # Map CIC columns to our feature columns
-    # This is a simplified mapping - adjust based on actual CIC column names
-    
-    # Common CIC column mappings (may vary by dataset version)
-    cic_mapping = {
-        'Total Fwd Packets': 'total_packets',
-        'Total Length of Fwd Packets': 'total_bytes',
-        'Flow Duration': 'duration',
-        'Flow Packets/s': 'pkts_per_sec',
-        'Flow Bytes/s': 'bytes_per_sec',
-        'SYN Flag Count': 'syn_count',
-        'Destination Port': 'unique_dst_ports'
-    }
-    
-    # Try to find matching columns
     available_cols = df.columns.tolist()
     
     # Create feature DataFrame
     feature_df = pd.DataFrame()
     
-    for cic_col, our_col in cic_mapping.items():
-        if cic_col in available_cols:
+    for our_col, cic_col in cic_feature_columns(available_cols).items():
+        if cic_col:
             feature_df[our_col] = df[cic_col]
         else:
-            # Try to find similar column
-            similar = [c for c in available_cols if our_col.replace('_', '').lower() in c.lower()]
-            if similar:
-                feature_df[our_col] = df[similar[0]]
-            else:
-                click.echo(f"Warning: Could not find column for {our_col}")
-                feature_df[our_col] = 0
+            click.echo(f"Warning: Could not find column for {our_col}")
+            feature_df[our_col] = 0
     
     # Extract label
     label_col = 'Label' if 'Label' in available_cols else ' Label'
     if label_col in available_cols:
-        labels = df[label_col].apply(lambda x: 0 if str(x).upper() == 'BENIGN' else 1)
+        is_attack = df[label_col].astype(str).str.upper().to_numpy() != 'BENIGN'
+        labels = pd.Series(is_attack.astype(np.int8), index=df.index)
     else:
         click.echo("Warning: No label column found, using all as benign")
         labels = pd.Series([0] * len(df))
@@ -122,13 +196,13 @@ def load_production_data(csv_path, min_confidence='low'):
         click.echo(f"Warning: Production data file not found: {csv_path}")
         return None, None
     
-    df = pd.read_csv(csv_path)
+    df = read_csv_columns(csv_path, FEATURE_COLS + ['label', 'confidence'], FEATURE_COLS)
     
     # Filter by confidence
     confidence_levels = {'high': 3, 'medium': 2, 'low': 1}
     min_conf_value = confidence_levels[min_confidence]
     
-    df = df[df['confidence'].map(lambda x: confidence_levels.get(x, 0) >= min_conf_value)]
+    df = df[df['confidence'].map(confidence_levels).fillna(0).to_numpy() >= min_conf_value]
     
     click.echo(f"Loaded {len(df)} labeled production samples (min confidence: {min_confidence})")
     
@@ -136,7 +210,7 @@ def load_production_data(csv_path, min_confidence='low'):
     feature_df = df[FEATURE_COLS]
     
     # Convert labels to binary
-    labels = df['label'].apply(lambda x: 1 if x == 'attack' else 0)
+    labels = pd.Series((df['label'].to_numpy() == 'attack').astype(np.int8), index=df.index)
     
     return feature_df, labels
 
@@ -151,7 +225,9 @@ def load_production_data(csv_path, min_confidence='low'):
 @click.option('--n-estimators', default=100, help='Number of trees in random forest')
 @click.option('--output-model', default='models/saved_models/rf_model_v2.joblib',
               help='Output path for new model')
-def retrain(production_data, min_confidence, test_size, use_smote, n_estimators, output_model):
+@click.option('--export-onnx', is_flag=True,
+              help='Also write an ONNX copy next to the model (for INFERENCE_BACKEND=onnx; needs skl2onnx)')
+def retrain(production_data, min_confidence, test_size, use_smote, n_estimators, output_model, export_onnx):
     """Retrain model with production data."""
     
     click.echo(f"\n{'='*80}")
@@ -168,8 +244,11 @@ def retrain(production_data, min_confidence, test_size, use_smote, n_estimators,
         
         if prod_features is not None:
             # Combine
-            X = pd.concat([cic_features, prod_features], ignore_index=True)
-            y = pd.concat([cic_labels, prod_labels], ignore_index=True)
+            # both frames already hold FEATURE_COLS in order: stack the values into one float32
+            # block instead of letting pd.concat rebuild and copy every column
+            X = pd.DataFrame(np.vstack([cic_features.to_numpy(np.float32),
+                                        prod_features.to_numpy(np.float32)]), columns=FEATURE_COLS)
+            y = pd.Series(np.concatenate([cic_labels.to_numpy(np.int8), prod_labels.to_numpy(np.int8)]))
             click.echo(f"\nCombined dataset: {len(X)} samples")
             click.echo(f"  CIC data: {len(cic_features)} samples")
             click.echo(f"  Production data: {len(prod_features)} samples")
@@ -184,13 +263,17 @@ def retrain(production_data, min_confidence, test_size, use_smote, n_estimators,
         return
     
     # Clean data
-    X = X.fillna(0)
-    X = X.replace([np.inf, -np.inf], 0)
+    # NaN/+-inf -> 0 in one pass over a single float32 copy (the tree splitter works in float32,
+    # so fit doesn't need to convert again)
+    values = np.nan_to_num(X.to_numpy(np.float32, copy=True), copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    X = pd.DataFrame(values, columns=X.columns, index=X.index)
+    y = y.astype(np.int8, copy=False)
     
     # Class distribution
     click.echo(f"\nClass distribution:")
-    click.echo(f"  Benign: {sum(y == 0)} ({sum(y == 0)/len(y)*100:.1f}%)")
-    click.echo(f"  Attack: {sum(y == 1)} ({sum(y == 1)/len(y)*100:.1f}%)")
+    counts = np.bincount(np.asarray(y, dtype=np.int8), minlength=2)
+    click.echo(f"  Benign: {counts[0]} ({counts[0]/len(y)*100:.1f}%)")
+    click.echo(f"  Attack: {counts[1]} ({counts[1]/len(y)*100:.1f}%)")
     
     # Split data
     X_train, X_test, y_train, y_test = train_test_split(
@@ -221,7 +304,14 @@ def retrain(production_data, min_confidence, test_size, use_smote, n_estimators,
         class_weight='balanced'
     )
     
-    new_model.fit(X_train, y_train)
+    # Forest fitting is already thread-parallel (tree building releases the GIL); pin the threading
+    # backend so an outer joblib config can't switch it to process workers that pickle X per tree.
+    # On a free-threaded build (python3.13t with cp313t wheels) the remaining GIL-held sections
+    # go away too and fit scales with core count.
+    X_train = X_train.astype(np.float32, copy=False)
+    y_train = np.asarray(y_train, dtype=np.int8)
+    with joblib.parallel_backend('threading'):
+        new_model.fit(X_train, y_train)
     
     # Evaluate new model
     click.echo("\n" + "="*80)
@@ -276,19 +366,15 @@ def retrain(production_data, min_confidence, test_size, use_smote, n_estimators,
     
     # Feature importance
     click.echo("\nFeature Importance:")
-    importance_df = pd.DataFrame({
-        'feature': FEATURE_COLS,
-        'importance': new_model.feature_importances_
-    }).sort_values('importance', ascending=False)
-    
-    for _, row in importance_df.iterrows():
-        click.echo(f"  {row['feature']:20s}: {row['importance']:.4f}")
+    importances = new_model.feature_importances_
+    for i in np.argsort(-importances, kind='stable'):
+        click.echo(f"  {FEATURE_COLS[i]:20s}: {importances[i]:.4f}")
     
     # Save new model
     output_path = os.path.join(PROJECT_ROOT, output_model)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    joblib.dump(new_model, output_path)
+    joblib.dump(new_model, output_path, compress=MODEL_COMPRESS, protocol=pickle.HIGHEST_PROTOCOL)
     
     # Save metadata
     metadata = {
@@ -313,6 +399,10 @@ def retrain(production_data, min_confidence, test_size, use_smote, n_estimators,
     
     click.echo(f"\n✓ Model saved to: {output_path}")
     click.echo(f"✓ Metadata saved to: {metadata_path}")
+    if export_onnx:
+        from export_onnx import export_onnx as write_onnx
+        onnx_path = write_onnx(new_model, output_path)
+        click.echo(f"✓ ONNX model saved to: {onnx_path}")
     
     click.echo(f"\nTo use the new model, update MODEL_PATH in api/app.py:")
     click.echo(f"  MODEL_PATH = \"{output_model}\"")
@@ -320,6 +410,8 @@ def retrain(production_data, min_confidence, test_size, use_smote, n_estimators,
     click.echo(f"\nOr copy it over the current model:")
     click.echo(f"  cp {output_path} models/saved_models/rf_model.joblib")
     click.echo(f"  cp {metadata_path} models/saved_models/rf_model.joblib.meta.json")
+    if export_onnx:
+        click.echo(f"  cp {onnx_path} models/saved_models/rf_model.onnx")
 
 
 if __name__ == "__main__":
@@ -1,26 +1,72 @@
 # realtime_agent/generate_sample_pcap.py
-from scapy.all import Ether, IP, TCP, UDP, wrpcap
+# Frames are packed with struct and written as a classic libpcap file, so
+# regenerating the fixture needs neither Scapy's import nor its layer builders.
+import socket
+import struct
 import sys
 import os
+import time
+
+ETH_DST = bytes.fromhex("ffffffffffff")
+ETH_SRC = bytes.fromhex("020000000001")  # locally administered
+TCP_SYN, TCP_ACK = 0x02, 0x10
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def _frame(src, dst, proto, l4_header, payload):
+    """Ethernet/IPv4 frame around a TCP/UDP header (checksum field zeroed) and payload."""
+    src, dst = socket.inet_aton(src), socket.inet_aton(dst)
+    segment = l4_header + payload
+    pseudo = src + dst + struct.pack("!BBH", 0, proto, len(segment))
+    csum_at = 16 if proto == socket.IPPROTO_TCP else 6
+    segment = segment[:csum_at] + struct.pack("!H", _checksum(pseudo + segment)) + segment[csum_at + 2:]
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(segment), 1, 0, 64, proto, 0, src, dst)
+    ip = ip[:10] + struct.pack("!H", _checksum(ip)) + ip[12:]
+    return ETH_DST + ETH_SRC + b"\x08\x00" + ip + segment
+
+
+def _tcp(src, dst, sport, dport, flags, payload):
+    header = struct.pack("!HHIIBBHHH", sport, dport, 0, 0, 5 << 4, flags, 8192, 0, 0)
+    return _frame(src, dst, socket.IPPROTO_TCP, header, payload)
+
+
+def _udp(src, dst, sport, dport, payload):
+    header = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0)
+    return _frame(src, dst, socket.IPPROTO_UDP, header, payload)
+
 
 def make_packets():
     pkts = []
     # TCP exchange between two hosts
     for i in range(3):
-        pkts.append(Ether()/IP(src="10.0.0.1", dst="10.0.0.2")/
-                    TCP(sport=1234+i, dport=80, flags="S")/
-                    ("GET /%d" % i))
+        pkts.append(_tcp("10.0.0.1", "10.0.0.2", 1234 + i, 80, TCP_SYN, b"GET /%d" % i))
     for i in range(3):
-        pkts.append(Ether()/IP(src="10.0.0.2", dst="10.0.0.1")/
-                    TCP(sport=80, dport=1234+i, flags="SA")/
-                    ("HTTP/200 OK"))
+        pkts.append(_tcp("10.0.0.2", "10.0.0.1", 80, 1234 + i, TCP_SYN | TCP_ACK, b"HTTP/200 OK"))
     # some UDP traffic
     for i in range(5):
-        pkts.append(Ether()/IP(src="10.0.0.3", dst="10.0.0.4")/
-                    UDP(sport=5000+i, dport=53)/
-                    ("payload%d" % i))
+        pkts.append(_udp("10.0.0.3", "10.0.0.4", 5000 + i, 53, b"payload%d" % i))
     return pkts
 
+
+def make_pcap_bytes(pkts, start_ts=None, step=0.0001, linktype=1):
+    """Serialize frames as a libpcap file (Ethernet link type by default), spaced step seconds apart."""
+    start_ts = time.time() if start_ts is None else start_ts
+    out = [struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, linktype)]
+    for i, frame in enumerate(pkts):
+        sec, usec = divmod(round((start_ts + i * step) * 1e6), 1_000_000)
+        out.append(struct.pack("<IIII", sec, usec, len(frame), len(frame)))
+        out.append(frame)
+    return b"".join(out)
+
+
 if __name__ == "__main__":
     # compute project root relative to this script file
     script_dir = os.path.dirname(os.path.abspath(__file__))      # .../ids-project/realtime_agent
@@ -34,6 +80,6 @@ if __name__ == "__main__":
     os.makedirs(out_dir, exist_ok=True)
 
     pkts = make_packets()
-    wrpcap(out, pkts)
+    with open(out, "wb") as f:
+        f.write(make_pcap_bytes(pkts))
     print("Wrote", len(pkts), "packets to", out)
-
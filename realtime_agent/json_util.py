@@ -0,0 +1,9 @@
+# realtime_agent/json_util.py
+"""JSON encoding shared by the extractors (printed feature lines and API POST bodies)."""
+
+import orjson
+
+
+def dumps(obj):
+    """Compact JSON bytes (NumPy scalars/arrays serialize directly)."""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
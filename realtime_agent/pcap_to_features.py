@@ -9,107 +9,301 @@ Read a PCAP and compute simple per-source-IP aggregation features:
 - unique_dst_ports
 Also prints a small table of per-src feature vectors.
 Designed for offline PCAP -> feature extraction and learning.
+
+Classic libpcap files are memory-mapped and their header fields gathered straight into
+NumPy columns. Other captures (pcapng, unusual link types) are streamed with dpkt when it is
+installed (raw header parsing, no per-layer objects), otherwise with Scapy's PcapReader; the
+capture is never loaded whole. The columns are reduced per source with NumPy.
 """
 
-from scapy.all import rdpcap, TCP, IP
-from collections import defaultdict
+from array import array
+import mmap
+import socket
+import struct
 import sys
 
+import numpy as np
+
+try:
+    import dpkt
+except ImportError:
+    dpkt = None
+
 PCAP_PATH = sys.argv[1] if len(sys.argv) > 1 else "data/sample.pcap"
 
+# classic pcap magic (as read little-endian) -> (struct byte order, timestamp fraction divisor)
+PCAP_MAGIC = {
+    0xA1B2C3D4: ("<", 1e-6), 0xD4C3B2A1: (">", 1e-6),
+    0xA1B23C4D: ("<", 1e-9), 0x4D3CB2A1: (">", 1e-9),
+}
+LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_RAW = 1, 113, 101
+LINKTYPE_NULL, LINKTYPE_LOOP, LINKTYPE_IPV4 = 0, 108, 228
+# frames that are a bare IP packet: LINKTYPE_RAW / LINKTYPE_IPV4 in files, DLT_RAW (12, 14 on OpenBSD) live
+RAW_IP_LINKTYPES = frozenset((LINKTYPE_RAW, LINKTYPE_IPV4, 12, 14))
+
+
+def _u8(buf, idx):
+    # indices past a short packet are clamped here and masked out by the callers
+    return buf[np.minimum(idx, len(buf) - 1)].astype(np.int64)
+
+def _u16(buf, idx):
+    return (_u8(buf, idx) << 8) | _u8(buf, idx + 1)
+
+def _header_fields(buf, start, stop, linktype):
+    """(is_ip, src, syn, dport) for the records buf[start:stop], read for all packets at once.
+
+    Every result is a fresh array (fancy indexing copies), so nothing keeps a view of buf.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = _u16(buf, start + 12)
+        vlan = ethertype == 0x8100
+        ethertype = np.where(vlan, _u16(buf, start + 16), ethertype)
+        l3 = start + np.where(vlan, 18, 14)
+        is_ip = (ethertype == 0x0800) & (l3 <= stop)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        l3 = start + 16
+        is_ip = (_u16(buf, start + 14) == 0x0800) & (l3 <= stop)
+    else:
+        l3 = start
+        is_ip = np.ones(len(start), dtype=bool)
+    ver_ihl = _u8(buf, l3)
+    ihl = (ver_ihl & 0x0F) * 4
+    l4 = l3 + ihl
+    is_ip &= (ver_ihl >> 4 == 4) & (ihl >= 20) & (l4 <= stop)
+
+    proto = _u8(buf, l3 + 9)
+    first_frag = (_u16(buf, l3 + 6) & 0x1FFF) == 0
+    is_tcp = is_ip & first_frag & (proto == socket.IPPROTO_TCP) & (l4 + 20 <= stop)
+    is_udp = is_ip & first_frag & (proto == socket.IPPROTO_UDP) & (l4 + 8 <= stop)
+    src = (_u8(buf, l3 + 12) << 24) | (_u8(buf, l3 + 13) << 16) | (_u8(buf, l3 + 14) << 8) | _u8(buf, l3 + 15)
+    dport = np.where(is_tcp | is_udp, _u16(buf, l4 + 2), -1)
+    syn = is_tcp & ((_u8(buf, l4 + 13) & 0x02) != 0)
+    return is_ip, src, syn, dport
+
+def _read_columns_mmap(path):
+    """Gather (ts, src, size, syn, dport) columns from a classic pcap via mmap.
+
+    Only the 16-byte record headers are walked in Python; the link/IP/TCP/UDP fields are then
+    read for every packet at once with NumPy fancy indexing. Returns None for captures this
+    does not handle (pcapng, other link types), which then go through iter_packets.
+    """
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return None
+    with mm:
+        if len(mm) < 24:
+            return None
+        magic, = struct.unpack_from("<I", mm)
+        if magic not in PCAP_MAGIC:
+            return None
+        order, divisor = PCAP_MAGIC[magic]
+        linktype = struct.unpack_from(order + "I", mm, 20)[0] & 0xFFFF
+        if linktype not in (LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_RAW):
+            return None
+
+        rec = struct.Struct(order + "IIII")
+        secs, fracs, offs, caplens = array("Q"), array("Q"), array("Q"), array("Q")
+        off, end = 24, len(mm)
+        while off + 16 <= end:
+            sec, frac, caplen, _ = rec.unpack_from(mm, off)
+            off += 16
+            if off + caplen > end:  # truncated last record
+                break
+            secs.append(sec)
+            fracs.append(frac)
+            offs.append(off)
+            caplens.append(caplen)
+            off += caplen
+
+        start = np.frombuffer(offs, dtype=np.int64)
+        caplen = np.frombuffer(caplens, dtype=np.int64)
+        # the uint8 view of the mmap only lives for this call, so the mmap can close afterwards
+        is_ip, src, syn, dport = _header_fields(
+            np.frombuffer(mm, dtype=np.uint8), start, start + caplen, linktype)
+        ts = (np.frombuffer(secs, dtype=np.uint64)
+              + np.frombuffer(fracs, dtype=np.uint64) * divisor)
+
+    return (ts[is_ip], src[is_ip].astype(np.uint64), caplen[is_ip].astype(np.uint64),
+            syn[is_ip].astype(np.uint8), dport[is_ip].astype(np.int32))
+
+def _ethernet_payload(buf):
+    return dpkt.ethernet.Ethernet(buf).data
+
+def _sll_payload(buf):
+    return dpkt.sll.SLL(buf).data
+
+def _loopback_payload(buf):
+    # BSD loopback: 4-byte address family, host order (NULL) or network order (LOOP)
+    return dpkt.loopback.Loopback(buf).data
+
+def dpkt_link_decoder(linktype):
+    """Function turning a captured frame of this link type into its network-layer dpkt packet,
+    or None for link types not decoded here (callers then fall back to Scapy's dissectors)."""
+    if linktype == LINKTYPE_ETHERNET:
+        return _ethernet_payload
+    if linktype == LINKTYPE_LINUX_SLL:
+        return _sll_payload
+    if linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        return _loopback_payload
+    if linktype in RAW_IP_LINKTYPES:
+        return dpkt.ip.IP
+    return None
+
+def _iter_packets_dpkt(path):
+    """Yield (ts, src_ip_u32, size, is_syn, dport) for every IPv4 packet, parsed by dpkt (dport -1 = none)."""
+    with open(path, "rb") as f:
+        try:
+            reader = dpkt.pcap.Reader(f)
+        except ValueError:
+            f.seek(0)
+            reader = dpkt.pcapng.Reader(f)
+        decode = dpkt_link_decoder(reader.datalink())
+        if decode is None:
+            # link type dpkt isn't told how to read; Scapy knows many more
+            yield from _iter_packets_scapy(path)
+            return
+        for ts, buf in reader:
+            try:
+                ip = decode(buf)
+            except dpkt.Error:
+                continue
+            if not isinstance(ip, dpkt.ip.IP):
+                continue
+            l4 = ip.data
+            is_syn = False
+            dport = -1
+            if isinstance(l4, dpkt.tcp.TCP):
+                is_syn = bool(l4.flags & dpkt.tcp.TH_SYN)
+                dport = l4.dport
+            elif isinstance(l4, dpkt.udp.UDP):
+                dport = l4.dport
+            yield ts, int.from_bytes(ip.src, "big"), len(buf), is_syn, dport
+
+
+def _iter_packets_scapy(path):
+    """Same as _iter_packets_dpkt, using Scapy (slower; used when dpkt is not installed)."""
+    from scapy.all import PcapReader, TCP, UDP, IP
+
+    with PcapReader(path) as reader:
+        for pkt in reader:
+            # Only consider IP packets for this example
+            ip = pkt.getlayer(IP)
+            if ip is None:
+                continue
+            # one layer lookup each, by class (no name -> class registry lookup)
+            tcp = pkt.getlayer(TCP)
+            udp = pkt.getlayer(UDP) if tcp is None else None
+            # TCP flag SYN is 0x02 — check presence
+            is_syn = tcp is not None and bool(tcp.flags & 0x02)
+            # destination port if TCP/UDP
+            dport = tcp.dport if tcp is not None else (udp.dport if udp is not None else -1)
+            yield (float(pkt.time), int.from_bytes(socket.inet_aton(ip.src), "big"), len(pkt),
+                   is_syn, dport)
+
+
+def iter_packets(path):
+    return _iter_packets_dpkt(path) if dpkt is not None else _iter_packets_scapy(path)
+
+
+def read_packet_columns(path):
+    """(ts, src, size, syn, dport) arrays for every IPv4 packet, in capture order."""
+    cols = _read_columns_mmap(path)
+    if cols is not None:
+        return cols
+    ts, src, size, syn, dport = array("d"), array("Q"), array("Q"), array("B"), array("i")
+    for p_ts, p_src, p_size, p_syn, p_dport in iter_packets(path):
+        ts.append(p_ts)
+        src.append(p_src)
+        size.append(p_size)
+        syn.append(p_syn)
+        dport.append(p_dport)
+    return (np.frombuffer(ts, dtype=np.float64), np.frombuffer(src, dtype=np.uint64),
+            np.frombuffer(size, dtype=np.uint64), np.frombuffer(syn, dtype=np.uint8),
+            np.frombuffer(dport, dtype=np.int32))
+
+
+def aggregate_by_src(ts, src, size, syn, dport):
+    """Reduce per-packet columns to per-source columns, sources in first-seen order."""
+    uniq, first_idx, inv = np.unique(src, return_index=True, return_inverse=True)
+    n = len(uniq)
+    # relabel sources so group k is the k-th source seen in the capture
+    seen_order = np.argsort(first_idx)
+    rank = np.empty(n, dtype=np.intp)
+    rank[seen_order] = np.arange(n)
+    inv = rank[inv.ravel()]
+    uniq = uniq[seen_order]
+
+    # first/last timestamp per source: sort by group, then reduce each contiguous run
+    order = np.argsort(inv, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(inv[order]) != 0])
+    ts_sorted = ts[order]
+
+    # unique (source, port) pairs; -1 means "no TCP/UDP port", and port 0 isn't counted either
+    has_port = dport > 0
+    pairs = np.unique((inv[has_port].astype(np.int64) << 16) | dport[has_port])
+
+    return {
+        "src": uniq,
+        "total_packets": np.bincount(inv, minlength=n),
+        "total_bytes": np.bincount(inv, weights=size, minlength=n).astype(np.int64),
+        "first_ts": np.minimum.reduceat(ts_sorted, starts),
+        "last_ts": np.maximum.reduceat(ts_sorted, starts),
+        "syn_count": np.bincount(inv[syn != 0], minlength=n),
+        "unique_dst_ports": np.bincount(pairs >> 16, minlength=n),
+    }
+
+
 def analyze_pcap(path):
     print(f"[+] Reading PCAP: {path}")
-    pkts = rdpcap(path)
-    if len(pkts) == 0:
-        print("[!] No packets in file.")
-        return
-
-    per_src = defaultdict(lambda: {
-        "total_packets": 0,
-        "total_bytes": 0,
-        "first_ts": None,
-        "last_ts": None,
-        "syn_count": 0,
-        "unique_dst_ports": set()
-    })
-
-    # iterate packets in capture order (Scapy preserves order)
-    for pkt in pkts:
-        ts = float(pkt.time)
-        # Only consider IP packets for this example
-        if IP not in pkt:
-            continue
-        src = pkt[IP].src
-        dst = pkt[IP].dst
-        size = len(pkt)  # length in bytes (wire length)
-        per_src_entry = per_src[src]
-        per_src_entry["total_packets"] += 1
-        per_src_entry["total_bytes"] += size
-        if per_src_entry["first_ts"] is None or ts < per_src_entry["first_ts"]:
-            per_src_entry["first_ts"] = ts
-        if per_src_entry["last_ts"] is None or ts > per_src_entry["last_ts"]:
-            per_src_entry["last_ts"] = ts
-
-        # TCP flags -> SYN detection
-        if pkt.haslayer(TCP):
-            flags = pkt[TCP].flags
-            # TCP flag SYN is 0x02 — check presence
-            if flags & 0x02:
-                per_src_entry["syn_count"] += 1
 
-        # destination port if TCP/UDP
-        dport = None
-        try:
-            # scapy names: TCP.dport, UDP.dport
-            if pkt.haslayer("TCP"):
-                dport = pkt["TCP"].dport
-            elif pkt.haslayer("UDP"):
-                dport = pkt["UDP"].dport
-        except Exception:
-            dport = None
+    # packet fields as flat columns (capture order)
+    try:
+        ts, src, size, syn, dport = read_packet_columns(path)
+    except (OSError, ValueError) as exc:
+        print(f"[!] Could not read capture: {exc}")
+        return None
 
-        if dport:
-            per_src_entry["unique_dst_ports"].add(dport)
+    if not len(ts):
+        print("[!] No IP packets in file.")
+        return {}
+
+    agg = aggregate_by_src(ts, src, size, syn, dport)
+    duration = np.maximum(agg["last_ts"] - agg["first_ts"], 0.000001)
+    per_src = {
+        socket.inet_ntoa(int(ip).to_bytes(4, "big")): {
+            "total_packets": int(pkts),
+            "total_bytes": int(nbytes),
+            "duration": float(dur),
+            "pkts_per_sec": pkts / dur,
+            "bytes_per_sec": nbytes / dur,
+            "syn_count": int(syns),
+            "unique_dst_ports": int(ports),
+        }
+        for ip, pkts, nbytes, dur, syns, ports in zip(
+            agg["src"].tolist(), agg["total_packets"].tolist(), agg["total_bytes"].tolist(),
+            duration.tolist(), agg["syn_count"].tolist(), agg["unique_dst_ports"].tolist())
+    }
 
     # finalize features and print table
     print("\nPer-source summary:")
     header = ["src_ip","pkts","bytes","duration(s)","pkts/s","bytes/s","syns","unique_dst_ports_count"]
     print("{:<15} {:>6} {:>8} {:>12} {:>8} {:>10} {:>6} {:>6}".format(*header))
     for src, v in per_src.items():
-        duration = 0.0
-        if v["first_ts"] is not None and v["last_ts"] is not None:
-            duration = max( v["last_ts"] - v["first_ts"], 0.000001)
-        pkts_per_sec = v["total_packets"] / duration if duration>0 else v["total_packets"]
-        bytes_per_sec = v["total_bytes"] / duration if duration>0 else v["total_bytes"]
-
         print("{:<15} {:>6} {:>8} {:>12.3f} {:>8.3f} {:>10.1f} {:>6} {:>6}".format(
             src,
             v["total_packets"],
             v["total_bytes"],
-            duration,
-            pkts_per_sec,
-            bytes_per_sec,
+            v["duration"],
+            v["pkts_per_sec"],
+            v["bytes_per_sec"],
             v["syn_count"],
-            len(v["unique_dst_ports"])
+            v["unique_dst_ports"]
         ))
 
     # Also return dict for programmatic use
-    # Convert sets to counts
-    out = {}
-    for src, v in per_src.items():
-        duration = 0.0
-        if v["first_ts"] is not None and v["last_ts"] is not None:
-            duration = max( v["last_ts"] - v["first_ts"], 0.000001)
-        out[src] = {
-            "total_packets": v["total_packets"],
-            "total_bytes": v["total_bytes"],
-            "duration": duration,
-            "pkts_per_sec": v["total_packets"] / duration if duration>0 else v["total_packets"],
-            "bytes_per_sec": v["total_bytes"] / duration if duration>0 else v["total_bytes"],
-            "syn_count": v["syn_count"],
-            "unique_dst_ports": len(v["unique_dst_ports"])
-        }
-    return out
+    return per_src
 
 if __name__ == "__main__":
     analyze_pcap(PCAP_PATH)
@@ -9,15 +9,38 @@ Usage examples:
 """
 
 import argparse
+import os
+import sys
+import itertools
+import socket
 import threading
 import time
-import json
+import operator
 import requests
+from requests.adapters import HTTPAdapter
 from dataclasses import dataclass
-from typing import Optional, Dict, Deque, List, Tuple
-from collections import defaultdict, deque
+from typing import Optional, Dict, List, Tuple
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from scapy.all import rdpcap, IP, TCP, UDP, sniff, conf
+import numpy as np
+from scapy.all import PcapReader, IP, TCP, UDP, sniff, conf
+
+try:
+    import dpkt
+except ImportError:
+    dpkt = None
+
+try:
+    import pcap as pypcap  # libpcap bindings (pypcap), for live capture without Scapy
+except ImportError:
+    pypcap = None
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from realtime_agent.json_util import dumps
+from realtime_agent.pcap_to_features import dpkt_link_decoder
 
 # --- Config & helper types ---
 
@@ -33,7 +56,7 @@ FEATURE_KEYS = [
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class Event:
     ts: float
     src_ip: str
@@ -46,18 +69,122 @@ class Event:
     is_rst: int
     is_fin: int
 
-# Per-src buffer: deque of Event
-buffers: Dict[str, Deque[Event]] = defaultdict(lambda: deque())
+# TCP flag byte -> (is_syn, is_ack, is_rst, is_fin), as a table instead of four bit tests
+FLAG_MASKS = (0x02, 0x10, 0x04, 0x01)
+FLAGS_LUT = np.array([[int(flags & mask != 0) for mask in FLAG_MASKS] for flags in range(256)],
+                     dtype=np.int64)
+FLAG_BITS = [tuple(row) for row in FLAGS_LUT.tolist()]  # same table for scalar lookups
+
+PROTOS = ("TCP", "UDP", "OTHER")
+PROTO_CODES = {name: i for i, name in enumerate(PROTOS)}
+
+
+class SrcBuffer:
+    """Recent events of one source as NumPy columns; rows head..tail are live.
+
+    Appends go at tail; old rows are dropped by advancing head. When tail hits the end the
+    live rows are moved to the front, or the columns doubled if they are more than half full.
+    """
+
+    COLUMNS = (
+        ("ts", np.float64),
+        ("size", np.uint32),
+        ("flags", np.uint8),   # TCP flag bits at their wire positions (SYN 0x02, ACK 0x10, ...)
+        ("proto", np.uint8),   # index into PROTOS
+        ("dport", np.int32),   # -1 = no TCP/UDP port
+        ("dst", np.uint32),    # IPv4 destination
+    )
+
+    def __init__(self, capacity=64):
+        for name, dtype in self.COLUMNS:
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def _make_room(self):
+        live = len(self)
+        capacity = len(self.ts)
+        if live * 2 > capacity:
+            capacity *= 2
+        for name, dtype in self.COLUMNS:
+            old = getattr(self, name)
+            new = old if len(old) == capacity else np.empty(capacity, dtype=dtype)
+            new[:live] = old[self.head:self.tail]
+            setattr(self, name, new)
+        self.head, self.tail = 0, live
+
+    def append(self, ts, size, flags, proto, dport, dst):
+        if self.tail == len(self.ts):
+            self._make_room()
+        i = self.tail
+        self.ts[i] = ts
+        self.size[i] = size
+        self.flags[i] = flags
+        self.proto[i] = proto
+        self.dport[i] = dport
+        self.dst[i] = dst
+        self.tail = i + 1
+
+    def drop_before(self, ts):
+        """Forget events older than ts.
+
+        Live capture and replay can deliver packets slightly out of order, so ts is not assumed
+        sorted: the usual case (only a stale prefix) just advances head, anything else is compacted.
+        """
+        keep = self.ts[self.head:self.tail] >= ts
+        first = int(keep.argmax()) if len(keep) else 0
+        if not len(keep) or not keep[first]:
+            self.head = self.tail
+        elif keep[first:].all():
+            self.head += first
+        else:
+            kept = int(np.count_nonzero(keep))
+            for name, _ in self.COLUMNS:
+                col = getattr(self, name)
+                col[self.head:self.head + kept] = col[self.head:self.tail][keep]
+            self.tail = self.head + kept
+
+    def live(self, name):
+        return getattr(self, name)[self.head:self.tail]
+
 
-# Lock to protect buffers (sniffer thread -> aggregator thread)
+# Per-src buffer of recent events
+buffers: Dict[str, SrcBuffer] = {}
+
+# Lock for the buffers dict itself (adding/removing sources, snapshotting keys)
 buffers_lock = threading.Lock()
 
+# Each source's buffer is guarded by one of these shard locks (sniffer thread -> aggregator
+# thread), so a push only contends with work on sources in the same shard.
+# Lock order: shard lock, then buffers_lock.
+BUFFER_LOCK_SHARDS = 64
+buffer_locks = [threading.Lock() for _ in range(BUFFER_LOCK_SHARDS)]
+
+
+def lock_for(src):
+    return buffer_locks[hash(src) % BUFFER_LOCK_SHARDS]
+
 # Track last activity so we can drop stale srcs
 last_activity = defaultdict(lambda: 0.0)
 
 # Event to indicate replay finished
 replay_done = threading.Event()
 
+# Replay only sleeps when the next packet is due at least this far (seconds) in the future
+REPLAY_MIN_SLEEP = 0.001
+# ...and hands packets to the buffers at most this many at a time
+REPLAY_PUSH_BATCH = 256
+
+# Keep-alive HTTP session shared by every POST, so each step reuses pooled connections
+# instead of paying a TCP (and TLS) handshake per feature vector
+http_session = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)  # no retries: a re-sent /detect would double alerts and blocks
+http_session.mount("http://", _http_adapter)
+http_session.mount("https://", _http_adapter)
+
 # --- Packet -> Event conversion helper ---
 def packet_to_event(pkt) -> Optional[Event]:
     if IP not in pkt:
@@ -75,15 +202,7 @@ def packet_to_event(pkt) -> Optional[Event]:
     if pkt.haslayer(TCP):
         try:
             dport = int(pkt[TCP].dport)
-            flags = pkt[TCP].flags
-            if flags & 0x02:
-                is_syn = 1
-            if flags & 0x10:
-                is_ack = 1
-            if flags & 0x04:
-                is_rst = 1
-            if flags & 0x01:
-                is_fin = 1
+            is_syn, is_ack, is_rst, is_fin = FLAG_BITS[int(pkt[TCP].flags) & 0xFF]
         except Exception:
             pass
         proto = "TCP"
@@ -106,17 +225,118 @@ def packet_to_event(pkt) -> Optional[Event]:
         is_fin=is_fin,
     )
 
+def frame_to_event(ts, buf, decode) -> Optional[Event]:
+    """packet_to_event for a raw captured frame, parsed with dpkt (no Scapy layer objects).
+    decode is the frame's dpkt_link_decoder."""
+    try:
+        ip = decode(buf)
+    except dpkt.Error:
+        return None
+    if not isinstance(ip, dpkt.ip.IP):
+        return None
+    l4 = ip.data
+    dport = None
+    is_syn = is_ack = is_rst = is_fin = 0
+    proto = "OTHER"
+    if isinstance(l4, dpkt.tcp.TCP):
+        dport = l4.dport
+        is_syn, is_ack, is_rst, is_fin = FLAG_BITS[l4.flags & 0xFF]
+        proto = "TCP"
+    elif isinstance(l4, dpkt.udp.UDP):
+        dport = l4.dport
+        proto = "UDP"
+    return Event(
+        ts=ts,
+        src_ip=socket.inet_ntoa(ip.src),
+        dst_ip=socket.inet_ntoa(ip.dst),
+        size=len(buf),
+        dport=dport,
+        proto=proto,
+        is_syn=is_syn,
+        is_ack=is_ack,
+        is_rst=is_rst,
+        is_fin=is_fin,
+    )
+
+
+def iter_pcap_events(pcap_path):
+    """Stream (ts, Event or None) for every packet in the capture; dpkt when installed, else Scapy."""
+    if dpkt is None:
+        with PcapReader(pcap_path) as reader:
+            for p in reader:
+                yield float(p.time), packet_to_event(p)
+        return
+    with open(pcap_path, "rb") as f:
+        try:
+            reader = dpkt.pcap.Reader(f)
+        except ValueError:
+            f.seek(0)
+            reader = dpkt.pcapng.Reader(f)
+        decode = dpkt_link_decoder(reader.datalink())
+        if decode is not None:
+            for ts, buf in reader:
+                yield ts, frame_to_event(ts, buf, decode)
+            return
+    # link type dpkt isn't told how to read; Scapy knows many more
+    with PcapReader(pcap_path) as reader:
+        for p in reader:
+            yield float(p.time), packet_to_event(p)
+
 # --- Sniffer callback (for live mode) or replay append (replay mode) ---
+def _buffer_row(event):
+    """SrcBuffer.append arguments for an event."""
+    flags = (event.is_syn << 1) | (event.is_ack << 4) | (event.is_rst << 2) | event.is_fin
+    dport = -1 if event.dport is None else event.dport
+    dst = int.from_bytes(socket.inet_aton(event.dst_ip), "big") if event.dst_ip else 0
+    return event.ts, event.size, flags, PROTO_CODES[event.proto], dport, dst
+
+
+def _buffer_for(src):
+    """The source's buffer, created on first use; call with lock_for(src) held."""
+    buf = buffers.get(src)
+    if buf is None:
+        with buffers_lock:
+            buf = buffers[src] = SrcBuffer()
+    return buf
+
+
 def push_event(event):
     if event is None:
         return
-    ts = event.ts
     src = event.src_ip
-    with buffers_lock:
-        buffers[src].append(event)
-        last_activity[src] = ts
+    with lock_for(src):
+        _buffer_for(src).append(*_buffer_row(event))
+        last_activity[src] = event.ts
+
+
+def push_events(events):
+    """push_event for a batch: one lock acquisition per source instead of one per packet."""
+    by_src = defaultdict(list)
+    for event in events:
+        if event is not None:
+            by_src[event.src_ip].append(event)
+    for src, src_events in by_src.items():
+        with lock_for(src):
+            buf = _buffer_for(src)
+            for event in src_events:
+                buf.append(*_buffer_row(event))
+            last_activity[src] = src_events[-1].ts
 
 # --- Live sniff thread (if requested) ---
+def sniff_libpcap(iface=None, bpf_filter=None):
+    """Capture with libpcap directly: the BPF filter runs in the kernel and frames go to dpkt.
+    Returns False without capturing if dpkt can't decode the interface's link type."""
+    name = getattr(iface, "name", iface)  # scapy's conf.iface is an interface object
+    capture = pypcap.pcap(name=name, promisc=True, immediate=True)
+    decode = dpkt_link_decoder(capture.datalink())
+    if decode is None:
+        return False
+    if bpf_filter:
+        capture.setfilter(bpf_filter)
+    for ts, buf in capture:
+        push_event(frame_to_event(ts, buf, decode))
+
+
 def start_live_sniff(iface=None, bpf_filter=None):
     def _cb(pkt):
         ev = packet_to_event(pkt)
@@ -127,7 +347,8 @@ def start_live_sniff(iface=None, bpf_filter=None):
     if bpf_filter:
         kwargs["filter"] = bpf_filter
     try:
-        sniff(**kwargs)
+        if pypcap is None or dpkt is None or sniff_libpcap(iface, bpf_filter) is False:
+            sniff(**kwargs)
     except PermissionError:
         print("[sniff] Permission denied. Try running with sudo or elevated privileges.")
     except OSError as exc:
@@ -135,114 +356,126 @@ def start_live_sniff(iface=None, bpf_filter=None):
 
 # --- Replay thread (reads pcap and replays with timing) ---
 def start_replay(pcap_path, speed=1.0):
+    # packets are streamed from disk, never materialized as a whole
+    pkts = iter_pcap_events(pcap_path)
     try:
-        pkts = rdpcap(pcap_path)
+        first = next(pkts)
     except FileNotFoundError:
         print("[replay] pcap not found:", pcap_path)
         replay_done.set()
         return
-    if not pkts:
+    except StopIteration:
         print("[replay] no packets in pcap", pcap_path)
         replay_done.set()
         return
-    prev_ts = float(pkts[0].time)
-    for p in pkts:
-        cur_ts = float(p.time)
-        wait = max(0.0, (cur_ts - prev_ts) / max(1.0, speed))
-        time.sleep(wait)
-        ev = packet_to_event(p)
-        push_event(ev)
-        prev_ts = cur_ts
+    # pace against a monotonic anchor: no drift from sleep overshoot, and packets less than
+    # REPLAY_MIN_SLEEP ahead of schedule are pushed right away instead of costing a syscall each
+    # packets that are already due are handed over in batches (flushed before every sleep)
+    first_ts = first[0]
+    scale = max(1.0, speed)
+    t0 = time.monotonic()
+    pending = []
+    for cur_ts, ev in itertools.chain([first], pkts):
+        delay = t0 + (cur_ts - first_ts) / scale - time.monotonic()
+        if delay > REPLAY_MIN_SLEEP:
+            push_events(pending)
+            pending.clear()
+            time.sleep(delay)
+        pending.append(ev)
+        if len(pending) >= REPLAY_PUSH_BATCH:
+            push_events(pending)
+            pending.clear()
+    push_events(pending)
     # mark replay finished
     replay_done.set()
 
 # --- Aggregation: compute features for buffers within window ---
-def compute_features_for_src(src, window_size):
-    now = time.time()
+def _features_locked(src, now, window_size):
+    """Window features for src as of `now`; the caller must hold lock_for(src)."""
     window_start = now - window_size
-    with buffers_lock:
-        dq = buffers.get(src)
-        if not dq:
-            return None
-        # drop old events from left
-        while dq and dq[0].ts < window_start:
-            dq.popleft()
-        if not dq:
-            return None
-
-        total_packets = 0
-        total_bytes = 0
-        syn_count = 0
-        dst_ports = set()
-        dst_ips = set()
-        tcp_ack = 0
-        tcp_rst = 0
-        tcp_fin = 0
-        proto_counts: Dict[str, int] = defaultdict(int)
-
-        first_ts = None
-        last_ts = None
-
-        for ev in dq:
-            total_packets += 1
-            total_bytes += ev.size
-            syn_count += ev.is_syn
-            tcp_ack += ev.is_ack
-            tcp_rst += ev.is_rst
-            tcp_fin += ev.is_fin
-            if ev.dport is not None:
-                dst_ports.add(ev.dport)
-            if ev.dst_ip:
-                dst_ips.add(ev.dst_ip)
-            proto_counts[ev.proto] += 1
-
-            if first_ts is None or ev.ts < first_ts:
-                first_ts = ev.ts
-            if last_ts is None or ev.ts > last_ts:
-                last_ts = ev.ts
-
-        duration = 0.0
-        if first_ts is not None and last_ts is not None:
-            duration = max(last_ts - first_ts, 1e-6)
-        else:
-            duration = max(window_size, 1e-6)
-
-        avg_pkt_size = (total_bytes / total_packets) if total_packets > 0 else 0.0
-        pkts_per_sec = total_packets / duration if duration > 0 else 0.0
-        bytes_per_sec = total_bytes / duration if duration > 0 else 0.0
-
-        extras = {
-            "window_start": window_start,
-            "window_end": now,
-            "avg_pkt_size": avg_pkt_size,
-            "unique_dst_ips": len(dst_ips),
-            "tcp_ack": tcp_ack,
-            "tcp_rst": tcp_rst,
-            "tcp_fin": tcp_fin,
-            "proto_counts": dict(proto_counts),
-        }
-
-        features = {
-            "src_ip": src,
-            "total_packets": total_packets,
-            "total_bytes": total_bytes,
-            "duration": duration,
-            "pkts_per_sec": pkts_per_sec,
-            "bytes_per_sec": bytes_per_sec,
-            "syn_count": syn_count,
-            "unique_dst_ports": len(dst_ports) or 1,
-            "extra": extras,
-        }
-        return features
+    buf = buffers.get(src)
+    if not buf:
+        return None
+    # drop old events from left
+    buf.drop_before(window_start)
+    if not buf:
+        return None
+
+    ts = buf.live("ts")
+    dport = buf.live("dport")
+
+    total_packets = len(buf)
+    total_bytes = int(buf.live("size").sum(dtype=np.int64))
+    # one histogram pass over the flag bytes, then the table turns it into the four counts
+    syn_count, tcp_ack, tcp_rst, tcp_fin = (
+        np.bincount(buf.live("flags"), minlength=256) @ FLAGS_LUT).tolist()
+    # ports are bounded, so mark them in a 64 KiB bitmap instead of sorting for np.unique
+    port_seen = np.zeros(65536, dtype=np.bool_)
+    port_seen[dport[dport >= 0]] = True
+    unique_ports = int(np.count_nonzero(port_seen))
+    unique_dst_ips = len(np.unique(buf.live("dst")))
+    proto_counts = {PROTOS[i]: int(n) for i, n in
+                    enumerate(np.bincount(buf.live("proto"), minlength=len(PROTOS))) if n}
+
+    first_ts = float(ts.min())
+    last_ts = float(ts.max())
+    duration = max(last_ts - first_ts, 1e-6)
+
+    avg_pkt_size = (total_bytes / total_packets) if total_packets > 0 else 0.0
+    pkts_per_sec = total_packets / duration if duration > 0 else 0.0
+    bytes_per_sec = total_bytes / duration if duration > 0 else 0.0
+
+    extras = {
+        "window_start": window_start,
+        "window_end": now,
+        "avg_pkt_size": avg_pkt_size,
+        "unique_dst_ips": unique_dst_ips,
+        "tcp_ack": tcp_ack,
+        "tcp_rst": tcp_rst,
+        "tcp_fin": tcp_fin,
+        "proto_counts": proto_counts,
+    }
+
+    features = {
+        "src_ip": src,
+        "total_packets": total_packets,
+        "total_bytes": total_bytes,
+        "duration": duration,
+        "pkts_per_sec": pkts_per_sec,
+        "bytes_per_sec": bytes_per_sec,
+        "syn_count": syn_count,
+        "unique_dst_ports": unique_ports or 1,
+        "extra": extras,
+    }
+    return features
+
+
+def compute_features_for_src(src, window_size):
+    with lock_for(src):
+        return _features_locked(src, time.time(), window_size)
 
 # --- Poster: send features to API (synchronous requests by default) ---
+JSON_HEADERS = {"Content-Type": "application/json"}
+_feature_values = operator.itemgetter(*FEATURE_KEYS)
+
+
+def build_payload(feat):
+    """API payload for a feature dict: its FEATURE_KEYS fields plus "extra"."""
+    try:
+        # one C-level lookup of all keys (compute_features_for_src always sets every one)
+        payload = dict(zip(FEATURE_KEYS, _feature_values(feat)))
+    except KeyError:
+        payload = {key: feat[key] for key in FEATURE_KEYS if key in feat}
+    payload["extra"] = feat.get("extra", {})
+    return payload
+
 def post_features_to_api(features_list, api_url="http://127.0.0.1:8000/detect", verify=True, headers=None):
     out = []
     for feat in features_list:
         try:
-            payload = {key: feat[key] for key in FEATURE_KEYS if key in feat}
-            payload.setdefault("extra", feat.get("extra", {}))
-            r = requests.post(api_url, json=payload, timeout=5, verify=verify, headers=headers)
+            payload = build_payload(feat)
+            r = http_session.post(api_url, data=dumps(payload), timeout=5, verify=verify,
+                                  headers={**JSON_HEADERS, **(headers or {})})
             # safe parse
             try:
                 body = r.json()
@@ -255,46 +488,51 @@ def post_features_to_api(features_list, api_url="http://127.0.0.1:8000/detect",
 
 # --- Main loop: periodic aggregation and optional posting ---
 def start_aggregator(window_size=5.0, step=1.0, post=False, batch=1, keep_idle_for=60.0,
-                     mode="replay", api_url="http://127.0.0.1:8000/detect", verify=True, headers=None):
+                     mode="replay", api_url="http://127.0.0.1:8000/detect", verify=True, headers=None,
+                     post_workers=8):
     """
     Periodically (every `step`) compute features for each active src and optionally post them.
+    Batches of a step are POSTed concurrently over `post_workers` threads (sharing the pooled session).
     The aggregator will exit automatically in replay mode when replay_done is set AND buffers empty.
     """
     print("[aggregator] starting: window_size=%s step=%s post=%s batch=%s mode=%s" % (
         window_size, step, post, batch, mode))
+    post_pool = ThreadPoolExecutor(max_workers=max(1, post_workers), thread_name_prefix="post")
+
+    def _post_chunk(chunk):
+        return post_features_to_api(chunk, api_url=api_url, verify=verify, headers=headers)
+
     try:
         while True:
-            t0 = time.time()
+            t0 = now = time.time()
             # snapshot active sources
             with buffers_lock:
                 srcs = list(buffers.keys())
             features_batch = []
             for src in srcs:
-                feat = compute_features_for_src(src, window_size)
-                if feat:
-                    features_batch.append(feat)
-                # drop completely idle sources
-                last_ts = last_activity.get(src, 0.0)
-                if (time.time() - last_ts) > keep_idle_for:
-                    with buffers_lock:
-                        try:
-                            del buffers[src]
-                            del last_activity[src]
-                        except KeyError:
-                            pass
+                # one lock hold per src covers both the features and the idle check
+                with lock_for(src):
+                    feat = _features_locked(src, now, window_size)
+                    if feat:
+                        features_batch.append(feat)
+                    # drop completely idle sources
+                    if (now - last_activity.get(src, 0.0)) > keep_idle_for:
+                        with buffers_lock:
+                            buffers.pop(src, None)
+                            last_activity.pop(src, None)
             # send in batches if requested
             if post and features_batch:
-                for i in range(0, len(features_batch), batch):
-                    chunk = features_batch[i:i+batch]
-                    results = post_features_to_api(chunk, api_url=api_url, verify=verify, headers=headers)
+                chunks = [features_batch[i:i+batch] for i in range(0, len(features_batch), batch)]
+                # the requests overlap (I/O bound); map still yields results in batch order
+                for results in post_pool.map(_post_chunk, chunks):
                     for r in results:
                         print("[POST]", r)
             else:
-                for f in features_batch:
-                    print(json.dumps(f))
+                if features_batch:
+                    print("\n".join(dumps(f).decode() for f in features_batch))
             # Check for replay termination condition:
             if mode == "replay" and replay_done.is_set():
-                # If replay is done and no more buffered events (all deques empty), then exit
+                # If replay is done and no more buffered events (all buffers empty), then exit
                 with buffers_lock:
                     any_nonempty = any(len(dq) > 0 for dq in buffers.values())
                 if not any_nonempty:
@@ -306,6 +544,8 @@ def start_aggregator(window_size=5.0, step=1.0, post=False, batch=1, keep_idle_f
             time.sleep(to_sleep)
     except KeyboardInterrupt:
         print("[aggregator] stopped by user")
+    finally:
+        post_pool.shutdown(wait=False, cancel_futures=True)
 
 # --- Command-line entrypoint ---
 def main():
@@ -317,6 +557,8 @@ def main():
     parser.add_argument("--step", type=float, default=1.0)
     parser.add_argument("--post", action="store_true")
     parser.add_argument("--batch", type=int, default=1, help="batch size for POST")
+    parser.add_argument("--post-workers", type=int, default=8,
+                        help="Concurrent POSTs per aggregation step")
     parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
     parser.add_argument("--api-url", default="http://127.0.0.1:8000/detect", help="Detection endpoint URL")
     parser.add_argument("--idle-timeout", type=float, default=60.0,
@@ -346,6 +588,7 @@ def main():
             keep_idle_for=args.idle_timeout,
             api_url=args.api_url,
             verify=verify,
+            post_workers=args.post_workers,
         )
     else:
         if not args.pcap:
@@ -362,6 +605,7 @@ def main():
             keep_idle_for=args.idle_timeout,
             api_url=args.api_url,
             verify=verify,
+            post_workers=args.post_workers,
         )
 
 if __name__ == "__main__":
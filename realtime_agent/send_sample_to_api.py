@@ -4,6 +4,7 @@ from realtime_agent.pcap_to_features import analyze_pcap
 
 API = "http://127.0.0.1:8000/detect"
 features = analyze_pcap("data/sample.pcap")  # returns a dict keyed by src_ip
+session = requests.Session()  # reuse one connection for every POST
 
 for src, fv in features.items():
     payload = {
@@ -18,7 +19,7 @@ for src, fv in features.items():
     }
     print("Posting for", src, payload)
     try:
-        r = requests.post(API, json=payload, timeout=3)
+        r = session.post(API, json=payload, timeout=3)
         print("->", r.status_code, r.json())
     except Exception as e:
         print("Request failed:", e)
@@ -8,88 +8,97 @@ Outputs printed JSON lines (one per src per window). You can change to POST to A
 """
 
 import argparse
-from scapy.all import rdpcap, IP, TCP, UDP
-from collections import defaultdict, deque
-import time, json
+import os
+import socket
+import sys
+import time
 from datetime import datetime
 
-def extract_windows(pkts, window_size=5.0, step=1.0):
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from realtime_agent.json_util import dumps
+from realtime_agent.pcap_to_features import read_packet_columns
+
+def extract_windows(columns, window_size=5.0, step=1.0):
     """
-    pkts: list of scapy packets (ordered)
+    columns: (ts, src_u32, size, is_syn, dport) arrays as returned by
+             pcap_to_features.read_packet_columns (dport -1 = no TCP/UDP port)
     window_size: seconds
     step: seconds
     yields: (window_center_ts, src_ip, features_dict)
     """
-    # Convert packets to simple events: (ts, src, len, dst_port, is_syn)
-    events = []
-    for p in pkts:
-        if IP not in p:
-            continue
-        ts = float(p.time)
-        src = p[IP].src
-        size = len(p)
-        dport = None
-        is_syn = 0
-        if p.haslayer(TCP):
-            dport = int(p[TCP].dport)
-            flags = p[TCP].flags
-            if flags & 0x02:
-                is_syn = 1
-        elif p.haslayer(UDP):
-            try:
-                dport = int(p[UDP].dport)
-            except Exception:
-                dport = None
-        events.append((ts, src, size, dport, is_syn))
-
-    if not events:
+    ts, src, size, syn, dport = columns
+    if not len(ts):
         return
 
     # sort by ts (should already be sorted)
-    events.sort(key=lambda e: e[0])
+    order = np.argsort(ts, kind="stable")
+    ts, src, size, syn, dport = ts[order], src[order], size[order], syn[order], dport[order]
 
-    t_start = events[0][0]
-    t_end = events[-1][0]
+    t_start = float(ts[0])
+    t_end = float(ts[-1])
 
     # sliding windows from t_start to t_end
+    starts = []
     window_start = t_start
     while window_start <= t_end:
-        window_end = window_start + window_size
-        # gather events in window
-        per_src = defaultdict(lambda: {"total_packets":0, "total_bytes":0, "syn_count":0, "dst_ports": set(), "first_ts": None, "last_ts": None})
-        # We can binary-search to accelerate; for now simple linear scan (fine for small pcaps)
-        for ts, src, size, dport, is_syn in events:
-            if ts < window_start or ts >= window_end:
-                continue
-            v = per_src[src]
-            v["total_packets"] += 1
-            v["total_bytes"] += size
-            v["syn_count"] += is_syn
-            if dport is not None:
-                v["dst_ports"].add(dport)
-            if v["first_ts"] is None or ts < v["first_ts"]:
-                v["first_ts"] = ts
-            if v["last_ts"] is None or ts > v["last_ts"]:
-                v["last_ts"] = ts
+        starts.append(window_start)
+        window_start += step
+    starts = np.array(starts)
+    ends = starts + window_size
 
-        # emit features per src
-        for src, v in per_src.items():
-            duration = (v["last_ts"] - v["first_ts"]) if (v["first_ts"] and v["last_ts"]) else 0.0
-            features = {
-                "window_start": window_start,
-                "window_end": window_end,
-                "src_ip": src,
-                "total_packets": v["total_packets"],
-                "total_bytes": v["total_bytes"],
-                "duration": duration,
-                "pkts_per_sec": v["total_packets"] / window_size,
-                "bytes_per_sec": v["total_bytes"] / window_size,
-                "syn_count": v["syn_count"],
-                "unique_dst_ports": len(v["dst_ports"])
-            }
-            yield (window_start + window_size/2.0, src, features)
+    # events grouped by source (ts order kept within a group), with running totals per group,
+    # so each (window, src) aggregate is two binary searches and a few differences
+    srcs, inv = np.unique(src, return_inverse=True)
+    by_src = np.argsort(inv, kind="stable")
+    group_bounds = np.searchsorted(inv[by_src], np.arange(len(srcs) + 1))
+    g_ts = ts[by_src]
+    g_bytes = np.concatenate(([0], np.cumsum(size[by_src], dtype=np.int64)))
+    g_syn = np.concatenate(([0], np.cumsum(syn[by_src], dtype=np.int64)))
+    g_ports = dport[by_src].tolist()
 
-        window_start += step
+    win, first, lo, hi = [], [], [], []
+    for k in range(len(srcs)):
+        g0, g1 = group_bounds[k], group_bounds[k + 1]
+        k_lo = np.searchsorted(g_ts[g0:g1], starts, side="left")
+        k_hi = np.searchsorted(g_ts[g0:g1], ends, side="left")
+        w = np.flatnonzero(k_hi > k_lo)
+        win.append(w)
+        first.append(by_src[g0 + k_lo[w]])  # capture position of the src's first event in the window
+        lo.append(g0 + k_lo[w])
+        hi.append(g0 + k_hi[w])
+    win, first, lo, hi = (np.concatenate(a) for a in (win, first, lo, hi))
+
+    # emit window by window, sources in order of their first packet in the window
+    emit = np.lexsort((first, win))
+    win, lo, hi = win[emit], lo[emit], hi[emit]
+    first_ts, last_ts = g_ts[lo], g_ts[hi - 1]
+    duration = np.where((first_ts != 0) & (last_ts != 0), last_ts - first_ts, 0.0)
+    names = [socket.inet_ntoa(ip.to_bytes(4, "big")) for ip in srcs.tolist()]
+    src_of = np.searchsorted(group_bounds, lo, side="right") - 1
+
+    for w, k, a, b, total_packets, total_bytes, syn_count, dur in zip(
+            win.tolist(), src_of.tolist(), lo.tolist(), hi.tolist(), (hi - lo).tolist(),
+            (g_bytes[hi] - g_bytes[lo]).tolist(), (g_syn[hi] - g_syn[lo]).tolist(), duration.tolist()):
+        window_start = starts[w]
+        ports = set(g_ports[a:b])
+        ports.discard(-1)
+        features = {
+            "window_start": float(window_start),
+            "window_end": float(ends[w]),
+            "src_ip": names[k],
+            "total_packets": total_packets,
+            "total_bytes": total_bytes,
+            "duration": dur,
+            "pkts_per_sec": total_packets / window_size,
+            "bytes_per_sec": total_bytes / window_size,
+            "syn_count": syn_count,
+            "unique_dst_ports": len(ports)
+        }
+        yield (window_start + window_size/2.0, names[k], features)
 
 def main():
     parser = argparse.ArgumentParser()
@@ -99,15 +108,20 @@ def main():
     parser.add_argument("--post", action="store_true", help="POST features to API (127.0.0.1:8000/detect)")
     args = parser.parse_args()
 
-    pkts = rdpcap(args.pcap)
-    for center_ts, src, features in extract_windows(pkts, window_size=args.window, step=args.step):
+    columns = read_packet_columns(args.pcap)
+    session = None
+    if args.post:
+        import requests
+        session = requests.Session()  # one keep-alive connection for all windows
+    for center_ts, src, features in extract_windows(columns, window_size=args.window, step=args.step):
         # print JSON line
-        print(json.dumps(features))
+        body = dumps(features)
+        print(body.decode())
         # optional: post to API
         if args.post:
-            import requests
             try:
-                r = requests.post("http://127.0.0.1:8000/detect", json=features, timeout=5)
+                r = session.post("http://127.0.0.1:8000/detect", data=body, timeout=5,
+                                 headers={"Content-Type": "application/json"})
                 print("->", r.status_code, r.json())
             except Exception as e:
                 print("POST failed:", e)
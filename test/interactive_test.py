@@ -10,6 +10,7 @@ import time
 from datetime import datetime
 
 API_BASE = "http://127.0.0.1:8000"
+session = requests.Session()  # keep-alive connection shared by every test request
 
 def print_banner():
     print("\n" + "="*60)
@@ -35,7 +36,7 @@ def send_flow(name, payload):
     print(f"   Source IP: {payload['src_ip']}")
     
     try:
-        resp = requests.post(f"{API_BASE}/detect", json=payload, timeout=5)
+        resp = session.post(f"{API_BASE}/detect", json=payload, timeout=5)
         result = resp.json()
         
         if result.get('alert'):
@@ -121,7 +122,7 @@ def test_brute_force():
 def check_alerts():
     print("\n📊 Recent Alerts:")
     try:
-        resp = requests.get(f"{API_BASE}/alerts/recent?limit=10", timeout=5)
+        resp = session.get(f"{API_BASE}/alerts/recent?limit=10", timeout=5)
         alerts = resp.json()
         
         if not alerts:
@@ -142,7 +143,7 @@ def check_alerts():
 def check_blocked():
     print("\n🔒 Blocked IPs:")
     try:
-        resp = requests.get(f"{API_BASE}/blocked?limit=50", timeout=5)
+        resp = session.get(f"{API_BASE}/blocked?limit=50", timeout=5)
         blocked = resp.json()
         
         if not blocked:
@@ -163,7 +164,7 @@ def set_threshold(value):
     print(f"\n⚙️  Setting threshold to {value}...")
     try:
         payload = {"threshold": value, "block_duration_sec": 300}
-        resp = requests.post(f"{API_BASE}/admin/config", json=payload, timeout=5)
+        resp = session.post(f"{API_BASE}/admin/config", json=payload, timeout=5)
         result = resp.json()
         print(f"   ✅ Threshold updated to {result['config']['threshold']}")
         print(f"   Block duration: {result['config']['block_duration_sec']}s")
@@ -206,7 +207,7 @@ def main():
     
     # Check if API is running
     try:
-        resp = requests.get(f"{API_BASE}/status", timeout=3)
+        resp = session.get(f"{API_BASE}/status", timeout=3)
         status = resp.json()
         print(f"\n✅ API Status: {status['status']}")
         print(f"   Live Capture: {'ON' if status['live_capture_active'] else 'OFF'}")
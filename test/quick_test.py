@@ -7,6 +7,7 @@ import requests
 import time
 
 API_BASE = "http://127.0.0.1:8000"
+session = requests.Session()  # keep-alive connection shared by every test request
 
 attacks = [
     {
@@ -83,9 +84,9 @@ print("=" * 60)
 # Lower threshold for demo
 print("\n⚙️  Lowering threshold to 0.25 for demo...")
 try:
-    requests.post(f"{API_BASE}/admin/config", 
-                  json={"threshold": 0.25, "block_duration_sec": 300},
-                  timeout=5)
+    session.post(f"{API_BASE}/admin/config", 
+                 json={"threshold": 0.25, "block_duration_sec": 300},
+                 timeout=5)
     print("✅ Threshold set to 0.25\n")
 except Exception as e:
     print(f"⚠️  Could not set threshold: {e}\n")
@@ -95,7 +96,7 @@ results = []
 for attack in attacks:
     print(f"Testing: {attack['name']}...")
     try:
-        resp = requests.post(f"{API_BASE}/detect", json=attack['payload'], timeout=5)
+        resp = session.post(f"{API_BASE}/detect", json=attack['payload'], timeout=5)
         result = resp.json()
         
         status = "🚨 BLOCKED" if result.get('alert') else "✓ Allowed"
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Regression test: captures that aren't Ethernet (loopback, raw IP) still yield
+per-source features and realtime events.
+"""
+import os
+import struct
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+from realtime_agent.generate_sample_pcap import make_packets, make_pcap_bytes
+from realtime_agent.pcap_to_features import analyze_pcap
+from realtime_agent.realtime_extractor import iter_pcap_events
+
+AF_INET = 2
+ETH_HEADER_LEN = 14
+SOURCES = {"10.0.0.1", "10.0.0.2", "10.0.0.3"}
+
+# linktype -> link header put in front of each bare IPv4 packet
+LINK_HEADERS = {
+    0: struct.pack("=I", AF_INET),    # DLT_NULL, host byte order
+    108: struct.pack("!I", AF_INET),  # DLT_LOOP, network byte order
+    101: b"",                         # LINKTYPE_RAW
+    228: b"",                         # LINKTYPE_IPV4
+}
+
+
+def write_capture(directory, linktype):
+    frames = [LINK_HEADERS[linktype] + frame[ETH_HEADER_LEN:] for frame in make_packets()]
+    path = os.path.join(directory, f"linktype_{linktype}.pcap")
+    with open(path, "wb") as f:
+        f.write(make_pcap_bytes(frames, start_ts=1_700_000_000.0, linktype=linktype))
+    return path
+
+
+def test_non_ethernet_linktypes():
+    with tempfile.TemporaryDirectory() as tmp:
+        for linktype in LINK_HEADERS:
+            path = write_capture(tmp, linktype)
+            features = analyze_pcap(path)
+            assert set(features) == SOURCES, (linktype, features)
+            assert features["10.0.0.1"]["syn_count"] == 3, (linktype, features["10.0.0.1"])
+            assert features["10.0.0.3"]["total_packets"] == 5, (linktype, features["10.0.0.3"])
+
+            events = [ev for _, ev in iter_pcap_events(path) if ev is not None]
+            assert len(events) == len(make_packets()), (linktype, len(events))
+            assert {ev.src_ip for ev in events} == SOURCES, linktype
+            print(f"✓ linktype {linktype}: {len(features)} sources, {len(events)} events")
+
+
+if __name__ == "__main__":
+    test_non_ethernet_linktypes()
@@ -4,9 +4,14 @@ Quick test of production data collection system.
 Tests that data is being collected and tools work.
 """
 import asyncio
+import atexit
 import os
 import sys
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -15,6 +20,87 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("IDS_DB", "idsdb")
 
+# Index keys the labeling workflow filters / sorts on (same specs api/app.py creates).
+# (labeled, collected_at) serves the labeled counts and the unlabeled queue in recency order;
+# collected_at keeps its own index because the unfiltered recency sort needs it as the prefix.
+RECOMMENDED_INDEXES = [
+    [("collected_at", -1)],
+    [("labeled", 1), ("collected_at", -1)],
+    [("src_ip", 1)],
+]
+
+# status footer / next steps, written in one go
+NEXT_STEPS = """\
+================================================================================
+System Status: Ready ✓
+================================================================================
+
+Next Steps:
+1. Start packet capture: ./start_capture.sh
+2. Wait for some traffic (or send test data)
+3. View stats: python api/label_data.py stats
+4. Start labeling: python api/label_data.py label --limit 10
+
+See PRODUCTION_DATA_GUIDE.md for full documentation"""
+
+_client = None
+
+
+def get_client():
+    """Shared Motor client, so repeated checks in one process reuse its connection pool."""
+    global _client
+    if _client is None:
+        # a handful of sequential queries: a small pool with one warm connection is plenty, and
+        # short timeouts make a down MongoDB fail in ~2s instead of the driver's default 30s
+        _client = AsyncIOMotorClient(MONGO_URI, maxPoolSize=5, minPoolSize=1,
+                                     serverSelectionTimeoutMS=2000, connectTimeoutMS=2000,
+                                     socketTimeoutMS=5000)
+        atexit.register(_client.close)
+    return _client
+
+
+def plan_stages(plan):
+    """Every stage name in an explain() plan tree (inputStage / inputStages / queryPlan nesting)."""
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= plan_stages(item)
+    return stages
+
+
+def key_spec(key):
+    """An index key document as a comparable tuple of (field, direction) pairs, in index order."""
+    # directions can come back as 1.0 / -1.0; special index types ("text", "2dsphere") stay strings
+    return tuple((field, int(d) if isinstance(d, (int, float)) else d) for field, d in key.items())
+
+
+async def production_data_index_keys(db):
+    """Full key spec of every index on production_data, or None if the collection doesn't exist.
+
+    $listCatalog (MongoDB 6.0+) answers both in one round-trip; older servers, or users
+    without the privilege, fall back to list_collection_names + list_indexes.
+    """
+    # Catalog entries come back as raw BSON and are decoded lazily: only md.indexes[*].spec.key is
+    # read, so options, idents and the rest are never turned into dicts
+    raw = db.get_collection("production_data", codec_options=CodecOptions(document_class=RawBSONDocument))
+    try:
+        catalog = await raw.aggregate([{"$listCatalog": {}}]).to_list(None)
+    except OperationFailure:
+        if 'production_data' not in await db.list_collection_names():
+            return None
+        index_keys = set()
+        async for idx in db.production_data.list_indexes():
+            index_keys.add(key_spec(idx['key']))
+        return index_keys
+    if not catalog:
+        return None
+    return {key_spec(idx["spec"]["key"]) for idx in catalog[0].get("md", {}).get("indexes", [])}
+
 
 async def test_production_data_collection():
     """Test that production data collection is working."""
@@ -23,18 +109,44 @@ async def test_production_data_collection():
     print("="*80 + "\n")
     
     # Connect to MongoDB
-    client = AsyncIOMotorClient(MONGO_URI)
-    db = client[DB_NAME]
+    db = get_client()[DB_NAME]
     
-    # Check if production_data collection exists
-    collections = await db.list_collection_names()
+    # Check if production_data collection exists (and fetch its indexes in the same call)
+    try:
+        index_keys = await production_data_index_keys(db)
+    except ServerSelectionTimeoutError as e:
+        print(f"✗ Cannot reach MongoDB at {MONGO_URI}: {e}")
+        print("  Start MongoDB (or set MONGO_URI in .env) and run this check again")
+        return
     
-    if 'production_data' in collections:
+    if index_keys is not None:
         print("✓ production_data collection exists")
+
+        # Create missing indexes first so the counts and the recent-sample lookup below use them
+        print("\nChecking recommended indexes...")
+        missing = []
+        for keys in RECOMMENDED_INDEXES:
+            # exact spec: a labeled_1 index doesn't stand in for (labeled, collected_at)
+            name = ", ".join(field for field, _ in keys)
+            if tuple(keys) in index_keys:
+                print(f"  ✓ Index on {name}")
+            else:
+                print(f"  ○ Missing index on {name}")
+                missing.append(IndexModel(keys))
+        if missing:
+            # one createIndexes command for all of them
+            created = await db.production_data.create_indexes(missing)
+            for name in created:
+                print(f"  + Created missing index {name}")
+        print()
         
-        # Count samples
-        total = await db.production_data.count_documents({})
-        labeled = await db.production_data.count_documents({"labeled": True})
+        # Count samples. The total is a metadata read (no scan), which is all a status probe needs;
+        # only the labeled count has a predicate, and it can use the labeled index.
+        # Both requests are in flight together.
+        total, labeled = await asyncio.gather(
+            db.production_data.estimated_document_count(),
+            db.production_data.count_documents({"labeled": True}),
+        )
         unlabeled = total - labeled
         
         print(f"✓ Total samples: {total}")
@@ -42,14 +154,31 @@ async def test_production_data_collection():
         print(f"  - Unlabeled: {unlabeled}")
         
         if total > 0:
-            # Show recent sample
-            sample = await db.production_data.find_one({}, sort=[("collected_at", -1)])
-            print(f"\n✓ Most recent sample:")
-            print(f"  Collected: {sample['collected_at']}")
-            print(f"  Source IP: {sample['src_ip']}")
-            print(f"  Predicted: {'Attack' if sample['prediction']['is_attack'] else 'Benign'}")
-            print(f"  Score: {sample['prediction']['score']:.4f}")
-            print(f"  Labeled: {sample['labeled']}")
+            # Show recent sample (only the printed fields; the collected_at index serves the sort)
+            sample = await db.production_data.find_one(
+                {},
+                projection={"_id": 0, "collected_at": 1, "src_ip": 1, "labeled": 1,
+                            "prediction.is_attack": 1, "prediction.score": 1},
+                sort=[("collected_at", -1)],
+            )
+            print("\n".join([
+                "\n✓ Most recent sample:",
+                f"  Collected: {sample['collected_at']}",
+                f"  Source IP: {sample['src_ip']}",
+                f"  Predicted: {'Attack' if sample['prediction']['is_attack'] else 'Benign'}",
+                f"  Score: {sample['prediction']['score']:.4f}",
+                f"  Labeled: {sample['labeled']}",
+            ]))
+
+            # The recency sort must come from the collected_at index; an in-memory SORT
+            # means the index is gone and the sort has to hold the whole collection
+            plan = await db.production_data.find({}, projection={"_id": 1}) \
+                .sort("collected_at", -1).limit(1).explain()
+            stages = plan_stages(plan.get("queryPlanner", {}).get("winningPlan", {}))
+            if "SORT" in stages or "COLLSCAN" in stages:
+                print(f"  ⚠ Recent-sample query is not index-backed (plan stages: {', '.join(sorted(stages))})")
+            else:
+                print("  ✓ Recent-sample query uses the collected_at index")
         else:
             print("\n⚠ No samples collected yet")
             print("  The collection will auto-populate when traffic is detected")
@@ -60,36 +189,7 @@ async def test_production_data_collection():
         print("  It will be created automatically when first data is collected")
         print("  Run the API and send a /detect request to initialize")
     
-    # Check indexes
-    print("\nChecking recommended indexes...")
-    if 'production_data' in collections:
-        indexes = await db.production_data.list_indexes().to_list(None)
-        index_fields = [idx.get('key', {}) for idx in indexes]
-        
-        recommended = [
-            ("collected_at", -1),
-            ("labeled", 1),
-            ("src_ip", 1),
-        ]
-        
-        for field, direction in recommended:
-            if any(field in idx for idx in index_fields):
-                print(f"  ✓ Index on {field}")
-            else:
-                print(f"  ○ Missing index on {field} (will create if needed)")
-    
-    print("\n" + "="*80)
-    print("System Status: Ready ✓")
-    print("="*80)
-    
-    print("\nNext Steps:")
-    print("1. Start packet capture: ./start_capture.sh")
-    print("2. Wait for some traffic (or send test data)")
-    print("3. View stats: python api/label_data.py stats")
-    print("4. Start labeling: python api/label_data.py label --limit 10")
-    print("\nSee PRODUCTION_DATA_GUIDE.md for full documentation")
-    
-    client.close()
+    print("\n" + NEXT_STEPS)
 
 
 if __name__ == "__main__":
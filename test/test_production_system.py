@@ -4,10 +4,79 @@ Test production data collection via API
 Since we have MongoDB SSL issues with direct connection,
 we'll verify through the API endpoints.
 """
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import orjson
 import requests
 import json
+from requests.adapters import HTTPAdapter
 
 API_URL = "http://127.0.0.1:8000"
+# /detect requests sent at once; the API's micro-batcher scores concurrent requests in one
+# predict call and writes their production_data docs with one insert_many
+DETECT_PROBES = max(1, int(os.getenv("DETECT_PROBES", "1")))
+_api = urlsplit(API_URL)
+API_ADDR = (_api.hostname, _api.port or (443 if _api.scheme == "https" else 80))
+
+session = requests.Session()  # keep-alive connections shared by the health probe and /detect
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=DETECT_PROBES))
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+TEST_FLOW = {
+    "src_ip": "192.168.1.100",
+    "total_packets": 1000,
+    "total_bytes": 500000,
+    "duration": 2.0,
+    "pkts_per_sec": 500.0,
+    "bytes_per_sec": 250000.0,
+    "syn_count": 25,
+    "unique_dst_ports": 50,
+    "extra": {"test": True}
+}
+# serialized once; every /detect probe sends these bytes as-is
+TEST_FLOW_BODY = orjson.dumps(TEST_FLOW)
+
+
+# closing summary / next steps, written in one go
+SUMMARY = """\
+================================================================================
+System Check Complete!
+================================================================================
+
+📊 Production Data Collection Features:
+   ✓ Auto-collection: Every /detect request saves to production_data
+   ✓ Ready for labeling once data accumulates
+
+📝 Next Steps:
+
+1. Collect Real Data (run for 1 week):
+   ./start_capture.sh
+
+2. View Collection Statistics:
+   python api/label_data.py stats
+
+3. Start Labeling:
+   python api/label_data.py label --limit 20
+
+4. Export Labeled Data:
+   python api/label_data.py export
+
+5. Retrain Model:
+   python models/retrain_with_production_data.py --use-smote
+
+📚 Full Documentation:
+   See PRODUCTION_DATA_GUIDE.md for complete workflow
+
+================================================================================
+"""
+
+
+def post_test_flow(_=None):
+    return session.post(f"{API_URL}/detect", data=TEST_FLOW_BODY, headers=JSON_HEADERS)
 
 
 def test_system():
@@ -18,7 +87,10 @@ def test_system():
     # Check API is running
     print("1. Testing API connection...")
     try:
-        response = requests.get(f"{API_URL}/alerts/recent?limit=1")
+        # a bare TCP connect fails in well under a second when nothing is listening,
+        # before paying for a full HTTP request
+        socket.create_connection(API_ADDR, timeout=0.5).close()
+        response = session.get(f"{API_URL}/alerts/recent?limit=1")
         if response.status_code == 200:
             print("   ✓ API is running")
         else:
@@ -33,20 +105,15 @@ def test_system():
     
     # Send test detection request
     print("\n2. Sending test detection request...")
-    test_flow = {
-        "src_ip": "192.168.1.100",
-        "total_packets": 1000,
-        "total_bytes": 500000,
-        "duration": 2.0,
-        "pkts_per_sec": 500.0,
-        "bytes_per_sec": 250000.0,
-        "syn_count": 25,
-        "unique_dst_ports": 50,
-        "extra": {"test": True}
-    }
-    
     try:
-        response = requests.post(f"{API_URL}/detect", json=test_flow)
+        if DETECT_PROBES > 1:
+            with ThreadPoolExecutor(max_workers=DETECT_PROBES) as pool:
+                responses = list(pool.map(post_test_flow, range(DETECT_PROBES)))
+            ok = sum(r.status_code == 200 for r in responses)
+            print(f"   - {ok}/{DETECT_PROBES} concurrent requests succeeded")
+        else:
+            responses = [post_test_flow()]
+        response = responses[0]
         if response.status_code == 200:
             result = response.json()
             print(f"   ✓ Detection successful")
@@ -59,35 +126,11 @@ def test_system():
     except Exception as e:
         print(f"   ✗ Detection error: {e}")
     
-    print("\n" + "="*80)
-    print("System Check Complete!")
-    print("="*80)
-    
-    print("\n📊 Production Data Collection Features:")
-    print("   ✓ Auto-collection: Every /detect request saves to production_data")
-    print("   ✓ Ready for labeling once data accumulates")
-    
-    print("\n📝 Next Steps:")
-    print("\n1. Collect Real Data (run for 1 week):")
-    print("   ./start_capture.sh")
-    
-    print("\n2. View Collection Statistics:")
-    print("   python api/label_data.py stats")
-    
-    print("\n3. Start Labeling:")
-    print("   python api/label_data.py label --limit 20")
-    
-    print("\n4. Export Labeled Data:")
-    print("   python api/label_data.py export")
-    
-    print("\n5. Retrain Model:")
-    print("   python models/retrain_with_production_data.py --use-smote")
-    
-    print("\n📚 Full Documentation:")
-    print("   See PRODUCTION_DATA_GUIDE.md for complete workflow")
-    
-    print("\n" + "="*80 + "\n")
+    print("\n" + SUMMARY)
 
 
 if __name__ == "__main__":
-    test_system()
+    try:
+        test_system()
+    finally:
+        session.close()